@@ -0,0 +1,50 @@
+''' Measure the cost of loading the Melani orthographic dictionary.
+
+Each sample is taken in a fresh interpreter, loading
+`melani_orthography.py` the same way Plover does, and then
+doing a first lookup (which may trigger building the theory).
+
+Usage: python benchmarks/bench_import.py [SAMPLES]
+'''
+
+import os
+import statistics
+import subprocess
+import sys
+
+
+SAMPLE = r'''
+import importlib.util, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('melani_orthography', %(filename)r)
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+loaded = time.perf_counter()
+mod.lookup(('SPsi',))
+looked_up = time.perf_counter()
+print(loaded - start, looked_up - loaded)
+'''
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    import plover_melani
+    filename = os.path.join(os.path.dirname(plover_melani.__file__),
+                            'dictionaries', 'melani_orthography.py')
+    load_times, lookup_times = [], []
+    for __ in range(samples):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          SAMPLE % {'filename': filename}])
+        load, lookup = map(float, output.split())
+        load_times.append(load)
+        lookup_times.append(lookup)
+    for name, times in (
+        ('load', load_times),
+        ('first lookup', lookup_times),
+    ):
+        print('%-12s: min %7.1fms, median %7.1fms' % (
+            name, min(times) * 1000, statistics.median(times) * 1000))
+
+
+if __name__ == '__main__':
+    main()
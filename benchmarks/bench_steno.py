@@ -0,0 +1,72 @@
+''' Measure steno parsing and formatting over `melani_main.json`.
+
+Compare parsing every outline (and formatting it back) with `Stroke`,
+to the shared parser of `plover_melani.steno` (with a cold cache, and
+then a warm one).
+
+Note: with a cold cache, the shared parser is not faster than `Stroke`
+(most strokes only appear once in the main dictionary), its caches only
+pay off on inputs repeating the same strokes (e.g. vocabularies).
+
+Usage: python benchmarks/bench_steno.py [ROUNDS]
+'''
+
+import json
+import os
+import sys
+import time
+
+import plover_melani
+from plover_melani import steno
+from plover_melani.theory import Stroke
+
+
+def parse_with_stroke(outlines):
+    for outline in outlines:
+        stroke_list = [Stroke(s) for s in outline.split('/')]
+        '/'.join(str(s) for s in stroke_list)
+
+
+def parse_with_steno(outlines):
+    for outline in outlines:
+        steno.format_steno(steno.parse_steno(outline))
+
+
+def clear_caches():
+    for cache in (steno._strokes, steno._stroke_objects, steno._stenos):
+        cache.clear()
+
+
+def measure(fn, outlines, rounds, setup=None):
+    best = None
+    for __ in range(rounds):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn(outlines)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    filename = os.path.join(os.path.dirname(plover_melani.__file__),
+                            'dictionaries', 'melani_main.json')
+    with open(filename, encoding='utf-8') as fp:
+        outlines = list(json.load(fp))
+    print('%u outlines' % len(outlines))
+    results = [
+        ('Stroke', measure(parse_with_stroke, outlines, rounds)),
+        ('steno (cold cache)', measure(parse_with_steno, outlines, rounds,
+                                       clear_caches)),
+        ('steno (warm cache)', measure(parse_with_steno, outlines, rounds)),
+    ]
+    for name, elapsed in results:
+        print('%-20s %8.2fms %10.0f outlines/s' % (
+            name, elapsed * 1e3, len(outlines) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
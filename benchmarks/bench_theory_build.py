@@ -0,0 +1,52 @@
+''' Benchmark building (and incrementally updating) a theory
+from a large synthetic orthography.
+
+Usage: python benchmarks/bench_theory_build.py [FRAGMENTS]
+'''
+
+import random
+import string
+import sys
+import time
+
+from plover_melani import system
+from plover_melani.theory import Stroke, Theory
+
+
+def synthetic_fragments(count, seed=0):
+    rng = random.Random(seed)
+    # Avoid the number key, so number strokes are not generated.
+    keys = system.KEYS[1:]
+    fragments = {}
+    while len(fragments) < count:
+        stroke = Stroke(rng.sample(keys, rng.randint(1, 6)))
+        text = ''.join(rng.choice(string.ascii_lowercase)
+                       for __ in range(rng.randint(1, 8)))
+        if rng.random() < 0.5:
+            text += '{^}'
+        fragments[str(stroke)] = text
+    return fragments
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    fragments = synthetic_fragments(count)
+    start = time.perf_counter()
+    theory = Theory(fragments)
+    elapsed = time.perf_counter() - start
+    print('build %u fragments: %.3fs' % (count, elapsed))
+    updates = list(fragments.items())[:1000]
+    start = time.perf_counter()
+    for steno, __ in updates:
+        theory.remove_fragment(steno)
+    elapsed = time.perf_counter() - start
+    print('remove_fragment: %.1fus/op' % (elapsed / len(updates) * 1e6))
+    start = time.perf_counter()
+    for steno, translation in updates:
+        theory.add_fragment(steno, translation)
+    elapsed = time.perf_counter() - start
+    print('add_fragment: %.1fus/op' % (elapsed / len(updates) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
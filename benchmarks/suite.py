@@ -0,0 +1,259 @@
+''' Benchmark suite for the theory and the orthographic dictionary.
+
+Workloads are derived from the bundled dictionaries:
+
+- theory_build: building a theory from `melani_orthography.json`
+- translate_stroke: translating every orthographic combo
+- translate_stroke_miss: translating random untranslatable strokes
+- strokes_to_text: translating every `melani_main.json` outline the
+  orthography can translate
+- strokes_from_text: reverse looking up every word of `melani_main.json`
+- lookup / lookup_miss / reverse_lookup: same through `melani_orthography.py`,
+  loaded like Plover does (including its lookup cache)
+
+For each workload, the best of several rounds is reported (ops/s, and
+p50/p99 latency per operation). Each round starts from a fresh theory
+(and empty lookup caches), so rounds after the first are not just
+measuring cache hits.
+
+Results can be saved to a JSON file, and are compared against a baseline
+(by default `benchmarks/baseline.json`, which is machine specific and so
+not versioned, create it with `--save-baseline`): the exit status is
+non-zero if a workload is slower than its baseline by more than the
+given tolerance, or if there is no baseline (use `--no-baseline` to
+only report results).
+
+Usage:
+
+    python benchmarks/suite.py [--rounds N] [--output results.json]
+                               [--baseline FILE | --save-baseline | --no-baseline]
+                               [--tolerance 0.2] [WORKLOAD...]
+'''
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+
+import plover_melani
+from plover_melani import system
+from plover_melani.theory import Stroke, Theory
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+DICTIONARIES_DIR = os.path.join(os.path.dirname(plover_melani.__file__),
+                                'dictionaries')
+
+
+def _load_json(name):
+    with open(os.path.join(DICTIONARIES_DIR, name), encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def _load_orthography_module():
+    filename = os.path.join(DICTIONARIES_DIR, 'melani_orthography.py')
+    spec = importlib.util.spec_from_file_location('melani_orthography', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Workloads:
+
+    # Each workload returns `(setup, calls)`: `setup` is called before
+    # each round, and returns the function to call with each of `calls`.
+
+    def __init__(self, seed=0):
+        self.fragments = _load_json('melani_orthography.json')
+        self.theory = Theory(self.fragments)
+        self.orthography = _load_orthography_module()
+        self.combos = [Stroke.from_steno(steno) for steno in self.fragments]
+        rng = random.Random(seed)
+        self.misses = []
+        while len(self.misses) < 1000:
+            stroke = Stroke.from_integer(rng.getrandbits(len(system.KEYS)))
+            try:
+                self.theory.translate_stroke(stroke)
+            except KeyError:
+                self.misses.append(stroke)
+        main = _load_json('melani_main.json')
+        self.outlines = []
+        for steno in main:
+            try:
+                stroke_list = [Stroke(s) for s in steno.split('/')]
+                self.theory.strokes_to_text(stroke_list)
+            except (KeyError, ValueError):
+                continue
+            self.outlines.append(stroke_list)
+        self.words = sorted({
+            word
+            for translation in main.values()
+            for word in translation.split()
+            if word.isalpha()
+        })
+
+    def _fresh_theory(self):
+        # Note: theories memoize some results.
+        return Theory(self.fragments)
+
+    def _fresh_orthography(self):
+        # Note: also clears the module lookup caches.
+        self.orthography.load_theory(self.fragments)
+        return self.orthography
+
+    def theory_build(self):
+        fragments = self.fragments
+        return lambda: Theory, [(fragments,)] * 20
+
+    def translate_stroke(self):
+        return (lambda: self._fresh_theory().translate_stroke,
+                [(s,) for s in self.combos])
+
+    def translate_stroke_miss(self):
+        def setup():
+            translate_stroke = self._fresh_theory().translate_stroke
+            def translate(stroke):
+                try:
+                    translate_stroke(stroke)
+                except KeyError:
+                    pass
+            return translate
+        return setup, [(s,) for s in self.misses]
+
+    def strokes_to_text(self):
+        return (lambda: self._fresh_theory().strokes_to_text,
+                [(o,) for o in self.outlines])
+
+    def strokes_from_text(self):
+        return (lambda: self._fresh_theory().strokes_from_text,
+                [(w,) for w in self.words])
+
+    def lookup(self):
+        return (lambda: self._fresh_orthography().lookup,
+                [((str(s),),) for s in self.combos])
+
+    def lookup_miss(self):
+        def setup():
+            lookup = self._fresh_orthography().lookup
+            def lookup_miss(key):
+                try:
+                    lookup(key)
+                except KeyError:
+                    pass
+            return lookup_miss
+        return setup, [((str(s),),) for s in self.misses]
+
+    def reverse_lookup(self):
+        return (lambda: self._fresh_orthography().reverse_lookup,
+                [(w,) for w in self.words])
+
+    NAMES = (
+        'theory_build',
+        'translate_stroke',
+        'translate_stroke_miss',
+        'strokes_to_text',
+        'strokes_from_text',
+        'lookup',
+        'lookup_miss',
+        'reverse_lookup',
+    )
+
+
+def measure(setup, calls, rounds):
+    best = None
+    perf_counter_ns = time.perf_counter_ns
+    for __ in range(rounds):
+        fn = setup()
+        timings = []
+        for args in calls:
+            start = perf_counter_ns()
+            fn(*args)
+            timings.append(perf_counter_ns() - start)
+        total = sum(timings)
+        if best is None or total < best[0]:
+            best = (total, timings)
+    total, timings = best
+    timings.sort()
+    return {
+        'ops': len(timings),
+        'ops_per_sec': len(timings) / (total / 1e9) if total else float('inf'),
+        'p50_us': timings[len(timings) // 2] / 1e3,
+        'p99_us': timings[min(len(timings) - 1, len(timings) * 99 // 100)] / 1e3,
+    }
+
+
+def compare(results, baseline, tolerance):
+    ''' Return the list of workloads slower than `baseline`. '''
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        ratio = result['ops_per_sec'] / reference['ops_per_sec']
+        status = 'ok'
+        if ratio < 1 - tolerance:
+            status = 'REGRESSION'
+            regressions.append(name)
+        print('%-24s %6.2fx baseline  %s' % (name, ratio, status))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite.')
+    parser.add_argument('workloads', metavar='WORKLOAD', nargs='*',
+                        help='workloads to run (default: all): %s'
+                        % ', '.join(Workloads.NAMES))
+    parser.add_argument('--rounds', metavar='N', type=int, default=5,
+                        help='number of rounds per workload, the best one '
+                        'is kept (default: %(default)s)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='save results to FILE (JSON)')
+    baseline = parser.add_mutually_exclusive_group()
+    baseline.add_argument('--baseline', metavar='FILE', default=BASELINE,
+                          help='compare results against FILE (JSON, default: '
+                          '%s)' % os.path.relpath(BASELINE))
+    baseline.add_argument('--save-baseline', action='store_true',
+                          help='save results as the new default baseline')
+    baseline.add_argument('--no-baseline', action='store_true',
+                          help='only report results, without comparing '
+                          'them against a baseline')
+    parser.add_argument('--tolerance', metavar='RATIO', type=float, default=0.2,
+                        help='acceptable slowdown against the baseline '
+                        '(default: %(default)s)')
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in Workloads.NAMES:
+            parser.error('invalid workload: %s' % name)
+    workloads = Workloads()
+    results = {}
+    print('%-24s %8s %12s %10s %10s' % ('workload', 'ops', 'ops/s', 'p50 (us)', 'p99 (us)'))
+    for name in args.workloads or Workloads.NAMES:
+        setup, calls = getattr(workloads, name)()
+        result = results[name] = measure(setup, calls, args.rounds)
+        print('%-24s %8u %12.0f %10.1f %10.1f' % (
+            name, result['ops'], result['ops_per_sec'],
+            result['p50_us'], result['p99_us']))
+    if args.save_baseline:
+        args.output = BASELINE
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if args.save_baseline or args.no_baseline:
+        return
+    if not os.path.exists(args.baseline):
+        sys.exit('no baseline to compare against (%s): create one with '
+                 '--save-baseline, or use --no-baseline' % args.baseline)
+    with open(args.baseline, encoding='utf-8') as fp:
+        baseline = json.load(fp)
+    print()
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        sys.exit('performance regression: %s' % ', '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
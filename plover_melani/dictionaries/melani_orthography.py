@@ -1,28 +1,263 @@
-from plover_melani.theory import Stroke, Theory
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
 
+from plover import log
 
-theory = Theory()
+from plover_melani import instrumentation
+from plover_melani.instrumentation import instrumented
+from plover_melani.reverse_cache import (
+    ReverseLookupCache,
+    cache_key,
+    search_outlines,
+)
+from plover_melani.theory import (
+    META_ATTACH, Stroke, Theory,
+    orthography_filename,
+    read_orthography,
+)
+
+
+# Number of distinct strokes whose lookup result (translation or miss)
+# is memoized, can be overridden through the environment.
+LOOKUP_CACHE_SIZE = int(os.environ.get('PLOVER_MELANI_LOOKUP_CACHE_SIZE', 4096))
+
+# Maximum number of strokes of an orthographic outline, can be overridden
+# through the environment: with more than 1, multi-strokes outlines forming
+# a single word (each stroke attaching to the next one) are translated too,
+# so Plover can see them (e.g. to apply briefs to them).
+MAX_OUTLINE_LENGTH = max(1, int(os.environ.get('PLOVER_MELANI_LONGEST_KEY', 1)))
+
+# Maximum number of outlines returned by `reverse_lookup`
+# (e.g. shown in Plover suggestions), can be overridden
+# through the environment.
+REVERSE_LOOKUP_COUNT = int(os.environ.get('PLOVER_MELANI_REVERSE_LOOKUP_COUNT', 5))
+
+# Keep reverse lookups results across sessions (in `CONFIG_DIR`),
+# can be enabled through the environment.
+PERSISTENT_REVERSE_LOOKUP_CACHE = os.environ.get(
+    'PLOVER_MELANI_PERSISTENT_REVERSE_LOOKUP_CACHE', '0') not in ('', '0')
+
+# Minimum delay (in seconds) between checks for changes
+# to the user orthography (0 to disable hot reloading).
+RELOAD_CHECK_INTERVAL = float(os.environ.get('PLOVER_MELANI_RELOAD_CHECK_INTERVAL', 2))
+
+# Note: the theory is only built on first use, to keep
+# the dictionary (and so Plover startup) fast to load.
+#
+# Once built, a theory is never modified: on reload, an updated
+# copy is made in the background and then swapped in, so lookups
+# in progress on other threads keep using a consistent snapshot.
+theory = None
+_theory_lock = threading.Lock()
+_theory_mtime = None
+_reload_enabled = False
+_reload_thread = None
+_next_reload_check = 0
+
+def _orthography_mtime():
+    try:
+        return os.stat(orthography_filename()).st_mtime_ns
+    except OSError:
+        return None
+
+def _load_theory(fragments):
+    global theory, _theory_mtime, _reload_enabled
+    _theory_mtime = _orthography_mtime()
+    _reload_enabled = fragments is None
+    theory = Theory(fragments)
+    _translate_steno.cache_clear()
+    _translate_outline.cache_clear()
+    _outlines_from_text.cache_clear()
+
+def load_theory(fragments=None):
+    ''' (Re)build the theory, with hot reloading enabled
+    when using the default orthography (`fragments=None`).
+    '''
+    with _theory_lock:
+        _load_theory(fragments)
+    return theory
+
+def get_theory():
+    if theory is None:
+        with _theory_lock:
+            if theory is None:
+                _load_theory(None)
+    return theory
+
+def _check_reload():
+    global _next_reload_check, _reload_thread
+    if not _reload_enabled or RELOAD_CHECK_INTERVAL <= 0:
+        return
+    now = time.monotonic()
+    if now < _next_reload_check:
+        return
+    _next_reload_check = now + RELOAD_CHECK_INTERVAL
+    mtime = _orthography_mtime()
+    if mtime == _theory_mtime:
+        return
+    with _theory_lock:
+        if _reload_thread is not None and _reload_thread.is_alive():
+            return
+        _reload_thread = threading.Thread(target=_reload_theory,
+                                          args=(theory, mtime),
+                                          name='melani_orthography_reload',
+                                          daemon=True)
+        _reload_thread.start()
+
+def _reload_theory(current_theory, mtime):
+    global theory, _theory_mtime
+    try:
+        data = read_orthography()
+        fragments = json.loads(data.decode('utf-8'))
+        new_theory = current_theory.copy()
+        changes = new_theory.update(fragments)
+        new_theory.orthography_digest = hashlib.sha1(data).hexdigest()
+    except Exception:
+        log.error('reloading Melani orthography failed', exc_info=True)
+        new_theory = None
+    with _theory_lock:
+        # Don't retry until the orthography changes again.
+        _theory_mtime = mtime
+        if new_theory is None or theory is not current_theory:
+            return
+        theory = new_theory
+        _translate_steno.cache_clear()
+        _translate_outline.cache_clear()
+        _outlines_from_text.cache_clear()
+    log.info('reloaded Melani orthography: %u combo(s) changed', changes)
+
+@functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def _translate_steno(current_theory, steno):
+    # Note: return `None` on misses, so they get cached too.
+    try:
+        stroke = Stroke(steno)
+    except ValueError:
+        return None
+    try:
+        return current_theory.translate_stroke(stroke)
+    except KeyError:
+        return None
+
+@functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def _translate_outline(current_theory, key):
+    # Only translate outlines forming a single word, so an outline is
+    # the translation of its prefix (itself cached) extended with the
+    # last stroke, and a rejected prefix (the most common case) rejects
+    # all outlines starting with it with a single cache hit.
+    if len(key) == 2:
+        translation = _translate_steno(current_theory, key[0])
+    else:
+        translation = _translate_outline(current_theory, key[:-1])
+    if translation is None or not translation.endswith(META_ATTACH):
+        return None
+    last_translation = _translate_steno(current_theory, key[-1])
+    if last_translation is None:
+        return None
+    if last_translation.startswith(META_ATTACH):
+        last_translation = last_translation[len(META_ATTACH):]
+    return translation[:-len(META_ATTACH)] + last_translation
+
+_persistent_cache = None
+_persistent_cache_lock = threading.Lock()
+
+def _get_persistent_cache(current_theory):
+    global _persistent_cache
+    if not PERSISTENT_REVERSE_LOOKUP_CACHE:
+        return None
+    key = cache_key(current_theory, REVERSE_LOOKUP_COUNT)
+    if key is None:
+        return None
+    with _persistent_cache_lock:
+        if _persistent_cache is None or _persistent_cache.key != key:
+            if _persistent_cache is not None:
+                _persistent_cache.close()
+                _persistent_cache = None
+            try:
+                _persistent_cache = ReverseLookupCache(key)
+            except sqlite3.Error:
+                log.error('opening Melani reverse lookup cache failed',
+                          exc_info=True)
+                return None
+        return _persistent_cache
+
+class _IncompleteSearch(Exception):
+    # Used to return the results of a search cut short
+    # by its limits, as `lru_cache` does not memoize exceptions.
+
+    def __init__(self, outlines):
+        super().__init__()
+        self.outlines = outlines
+
+@functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def _outlines_from_text(current_theory, text):
+    # Note: the search is bounded in time, so suggestions never stall
+    # Plover, and memoized, so the outlines for a word don't change
+    # (unless the search was cut short, and may do better next time).
+    cache = _get_persistent_cache(current_theory)
+    if cache is not None:
+        try:
+            outlines = cache.get(text)
+        except sqlite3.Error:
+            outlines = None
+        if outlines is not None:
+            return outlines
+    outlines, complete = search_outlines(current_theory, text, REVERSE_LOOKUP_COUNT)
+    # Note: only persist the results of complete searches.
+    if complete and cache is not None:
+        try:
+            cache.put(text, outlines)
+        except sqlite3.Error:
+            # The cache is only an optimization.
+            pass
+    if not complete:
+        raise _IncompleteSearch(outlines)
+    return outlines
+
+def cache_info():
+    ''' Return lookup cache statistics (hits, misses, maxsize, currsize). '''
+    return _translate_steno.cache_info()
+
+def stats():
+    ''' Return lookup statistics, see `plover_melani.instrumentation`. '''
+    stats = instrumentation.stats()
+    stats['lookup_cache'] = cache_info()._asdict()
+    stats['outline_cache'] = _translate_outline.cache_info()._asdict()
+    stats['reverse_lookup_cache'] = _outlines_from_text.cache_info()._asdict()
+    stats['prefilter_rejections'] = 0 if theory is None else theory.prefilter_rejections
+    return stats
 
 # Required interface for Plover "Python" dictionary. {{{
 
-LONGEST_KEY = 1
+LONGEST_KEY = MAX_OUTLINE_LENGTH
 
+@instrumented('lookup')
 def lookup(key):
     assert len(key) <= LONGEST_KEY
-    try:
-        stroke_list = [Stroke(s) for s in key]
-    except ValueError as e:
-        raise KeyError from e
-    translation = ''
-    for stroke in stroke_list:
-        translation += theory.translate_stroke(stroke)
+    _check_reload()
+    current_theory = get_theory()
+    if len(key) == 1:
+        translation = _translate_steno(current_theory, key[0])
+    elif key:
+        translation = _translate_outline(current_theory, tuple(key))
+    else:
+        translation = ''
+    if translation is None:
+        raise KeyError
     return translation
 
+@instrumented('reverse_lookup', track_slowest=True)
 def reverse_lookup(text):
-    stroke_list = theory.strokes_from_text(text)
-    if not stroke_list:
-        return []
-    return [tuple(str(s) for s in stroke_list)]
+    _check_reload()
+    try:
+        outlines = _outlines_from_text(get_theory(), text)
+    except _IncompleteSearch as e:
+        outlines = e.outlines
+    return list(outlines)
 
 # }}}
 
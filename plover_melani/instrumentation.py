@@ -0,0 +1,134 @@
+''' Optional instrumentation of lookups (counts and latencies).
+
+Disabled by default, enable it by setting `PLOVER_MELANI_STATS` in the
+environment: to `1`, or to a filename to also dump the statistics to
+(as JSON) on exit. When disabled, `instrumented` returns the functions
+unchanged, so there is no overhead.
+'''
+
+import atexit
+import functools
+import heapq
+import json
+import os
+import threading
+import time
+
+
+_STATS_ENV = os.environ.get('PLOVER_MELANI_STATS', '')
+
+ENABLED = _STATS_ENV not in ('', '0')
+
+# Histogram buckets upper bounds (in microseconds),
+# the last bucket is for anything slower.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Number of slowest inputs to keep track of.
+SLOWEST = 20
+
+
+class _Stats:
+
+    __slots__ = ('calls', 'misses', 'total', 'max', 'histogram', 'slowest')
+
+    def __init__(self):
+        self.calls = 0
+        self.misses = 0
+        self.total = 0
+        self.max = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        # Min-heap of (elapsed, input).
+        self.slowest = []
+
+    def as_dict(self):
+        histogram = {
+            '<=%uus' % bound: count
+            for bound, count in zip(BUCKETS, self.histogram)
+        }
+        histogram['>%uus' % BUCKETS[-1]] = self.histogram[-1]
+        return {
+            'calls': self.calls,
+            'misses': self.misses,
+            'total_ms': self.total / 1e6,
+            'max_us': self.max / 1e3,
+            'histogram': histogram,
+            'slowest': [
+                {'input': input, 'us': elapsed / 1e3}
+                for elapsed, input in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _record(stats, elapsed, miss, input):
+    with _lock:
+        stats.calls += 1
+        if miss:
+            stats.misses += 1
+        stats.total += elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        us = elapsed / 1e3
+        for n, bound in enumerate(BUCKETS):
+            if us <= bound:
+                stats.histogram[n] += 1
+                break
+        else:
+            stats.histogram[-1] += 1
+        if input is not None:
+            entry = (elapsed, input)
+            if len(stats.slowest) < SLOWEST:
+                heapq.heappush(stats.slowest, entry)
+            elif entry > stats.slowest[0]:
+                heapq.heapreplace(stats.slowest, entry)
+
+
+def _last_argument(*args, **kwargs):
+    return args[-1]
+
+
+def instrumented(name, track_slowest=False, input=_last_argument, miss=None):
+    ''' Decorator recording statistics for calls under `name`.
+
+    A call is counted as a miss if it raises `KeyError`, or if
+    `miss(result)` is true (default: for an empty result). With
+    `track_slowest`, the inputs of the slowest calls are recorded too:
+    `input(*args, **kwargs)` (default: the last positional argument).
+    '''
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        stats = _stats.setdefault(name, _Stats())
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                result = fn(*args, **kwargs)
+            except KeyError:
+                _record(stats, time.perf_counter_ns() - start, True,
+                        repr(input(*args, **kwargs)) if track_slowest else None)
+                raise
+            elapsed = time.perf_counter_ns() - start
+            _record(stats, elapsed, not result if miss is None else miss(result),
+                    repr(input(*args, **kwargs)) if track_slowest else None)
+            return result
+        return wrapper
+    return decorator
+
+
+def stats():
+    ''' Return a snapshot of the statistics (empty if disabled). '''
+    with _lock:
+        return {name: s.as_dict() for name, s in _stats.items()}
+
+
+def dump(filename):
+    with open(filename, 'w', encoding='utf-8') as fp:
+        json.dump(stats(), fp, indent=2)
+
+
+if ENABLED and _STATS_ENV != '1':
+    atexit.register(dump, _STATS_ENV)
@@ -0,0 +1,116 @@
+''' Persistent cache of reverse lookups (text to outlines).
+
+Reverse lookups only depend on the orthography contents (and the number
+of outlines returned), so their results can be kept across sessions in
+a SQLite database (in `CONFIG_DIR`), with entries keyed by the
+orthography digest and the number of outlines: entries for other
+digests are dropped on opening (but not entries for other counts, so
+e.g. `melani_prefillcache` and Plover can use different counts).
+
+Note: this is only the backing store, lookups should go through an
+in-memory LRU cache first (see `melani_orthography`).
+'''
+
+import os
+import sqlite3
+import threading
+
+from plover.oslayer.config import CONFIG_DIR
+
+
+def cache_filename():
+    return os.path.join(CONFIG_DIR, 'melani_reverse_lookup.db')
+
+
+def cache_key(theory, count):
+    ''' Return the cache key (a `(digest, count)` tuple) for reverse
+    lookups of up to `count` outlines using `theory`, or `None` if
+    those can't be cached (theory not built from an orthography).
+    '''
+    if theory.orthography_digest is None:
+        return None
+    return theory.orthography_digest, count
+
+
+def search_outlines(theory, text, count):
+    ''' Return `(outlines, complete)`, with up to `count` outlines for
+    `text` as a tuple of tuples of steno, see `Theory.search_outlines`.
+    '''
+    outlines, complete = theory.search_outlines(text, count)
+    return tuple(
+        tuple(str(s) for s in stroke_list)
+        for stroke_list in outlines
+    ), complete
+
+
+def _encode_outlines(outlines):
+    return ' '.join('/'.join(steno_list) for steno_list in outlines)
+
+def _decode_outlines(value):
+    return tuple(tuple(outline.split('/')) for outline in value.split())
+
+
+class ReverseLookupCache:
+
+    # Bumped on schema changes: the old table is then dropped.
+    SCHEMA_VERSION = 1
+
+    # Note: `sqlite3` keeps compiled statements in a per connection
+    # cache, so reusing the same query strings reuses prepared statements.
+    _SELECT = 'SELECT outlines FROM outlines WHERE digest = ? AND count = ? AND word = ?'
+    _INSERT = ('INSERT OR REPLACE INTO outlines (digest, count, word, outlines) '
+               'VALUES (?, ?, ?, ?)')
+
+    def __init__(self, key, filename=None):
+        ''' Open the cache for `key` (see `cache_key`). '''
+        self.key = key
+        digest, __ = key
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename or cache_filename(),
+                                   check_same_thread=False)
+        try:
+            with self._db:
+                self._db.execute('PRAGMA journal_mode = WAL')
+                self._db.execute('PRAGMA synchronous = NORMAL')
+                version, = self._db.execute('PRAGMA user_version').fetchone()
+                if version != self.SCHEMA_VERSION:
+                    self._db.execute('DROP TABLE IF EXISTS outlines')
+                    self._db.execute('PRAGMA user_version = %u' % self.SCHEMA_VERSION)
+                self._db.execute('CREATE TABLE IF NOT EXISTS outlines ('
+                                 'digest TEXT NOT NULL, count INTEGER NOT NULL, '
+                                 'word TEXT NOT NULL, outlines TEXT NOT NULL, '
+                                 'PRIMARY KEY (digest, count, word)) WITHOUT ROWID')
+                # Invalidate entries for other orthographies.
+                self._db.execute('DELETE FROM outlines WHERE digest != ?', (digest,))
+        except sqlite3.Error:
+            self._db.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, word):
+        ''' Return the cached outlines for `word`, or `None` if not cached. '''
+        with self._lock:
+            row = self._db.execute(self._SELECT, self.key + (word,)).fetchone()
+        if row is None:
+            return None
+        return _decode_outlines(row[0])
+
+    def put(self, word, outlines):
+        self.put_many(((word, outlines),))
+
+    def put_many(self, items):
+        ''' Cache each `(word, outlines)` from `items`. '''
+        with self._lock, self._db:
+            self._db.executemany(self._INSERT, (
+                self.key + (word, _encode_outlines(outlines))
+                for word, outlines in items
+            ))
@@ -0,0 +1,144 @@
+''' Helpers shared by the scripts. '''
+
+from collections import deque
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+import plover_melani
+
+
+MAIN_DICTIONARY = os.path.join(os.path.dirname(plover_melani.__file__),
+                               'dictionaries', 'melani_main.json')
+
+# Words, with elisions kept with the elided word (`l'`, `dell'`, ...).
+WORD_RX = re.compile(r"[^\W\d_]+'?")
+
+# Metas ignored when indexing dictionary translations.
+INDEX_META_RX = re.compile(r'\{\^\}|\{\$\}')
+
+
+# Dictionaries and word lists. {{{
+
+def load_dictionaries(filenames):
+    dictionaries = []
+    for filename in filenames:
+        with open(filename, encoding='utf-8') as fp:
+            dictionaries.append(json.load(fp))
+    return dictionaries
+
+def build_index(dictionaries):
+    ''' Build an inverted index of `dictionaries` (mappings of steno
+    to translation): for each single word translation, the number
+    of strokes of its shortest outline.
+    '''
+    index = {}
+    for dictionary in dictionaries:
+        for steno, translation in dictionary.items():
+            word = INDEX_META_RX.sub('', translation)
+            if WORD_RX.fullmatch(word) is None:
+                continue
+            nb_strokes = steno.count('/') + 1
+            if nb_strokes < index.get(word, nb_strokes + 1):
+                index[word] = nb_strokes
+    return index
+
+def read_frequencies(fp):
+    ''' Read a word frequency list: one word per line, optionally
+    with its count, and return a list of `(word, count)`.
+    '''
+    words = []
+    for rank, line in enumerate(fp):
+        fields = line.split()
+        if not fields:
+            continue
+        word = count = None
+        for field in fields:
+            if count is None and field.isdigit():
+                count = int(field)
+            elif word is None:
+                word = field
+        if word is None:
+            continue
+        if count is None:
+            # Assume a Zipf distribution.
+            count = 1 / (rank + 1)
+        words.append((word, count))
+    return words
+
+def load_frequencies(filename):
+    ''' Like `read_frequencies`, from `filename` (`-` for stdin). '''
+    if filename == '-':
+        return read_frequencies(sys.stdin)
+    with open(filename, encoding='utf-8') as fp:
+        return read_frequencies(fp)
+
+# }}}
+
+# Parallel processing. {{{
+
+def _jobs(value):
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise argparse.ArgumentTypeError('invalid number of jobs: %s' % value)
+    return jobs
+
+def add_jobs_argument(parser, mode=None):
+    ''' Add the `-j/--jobs` option to `parser` (only used in `mode`, if set). '''
+    parser.add_argument('-j', '--jobs', metavar='N', type=_jobs, default=1,
+                        help='number of parallel worker processes (%sdefault: '
+                        '%%(default)s)' % ('' if mode is None else 'in %s, ' % mode))
+
+def chunked(iterable, chunk_size):
+    ''' Split `iterable` in lists of (at most) `chunk_size` items. '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+@contextlib.contextmanager
+def worker_pool(jobs, initializer=None, initargs=()):
+    ''' Return a pool of `jobs` worker processes (each initialized with
+    `initializer(*initargs)`), terminated on exit; or with only one job,
+    `None` (after initializing the current process instead).
+    '''
+    if jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield None
+        return
+    pool = multiprocessing.Pool(jobs, initializer=initializer, initargs=initargs)
+    try:
+        yield pool
+    finally:
+        pool.terminate()
+
+def imap(pool, fn, tasks, jobs):
+    ''' Like `map(fn, tasks)`, but in `pool` (if not `None`), keeping
+    only a few tasks in flight (`Pool.imap` would consume all the tasks
+    upfront, e.g. reading a whole input in memory).
+    '''
+    if pool is None:
+        yield from map(fn, tasks)
+        return
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(fn, (task,)))
+        if len(pending) >= 2 * jobs:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+# }}}
+
+# vim: foldmethod=marker
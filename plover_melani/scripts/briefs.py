@@ -0,0 +1,158 @@
+''' Suggest single stroke briefs for frequent words.
+
+Read a word frequency list (one word per line, optionally with its
+count, otherwise the list is assumed to be sorted by frequency), and
+for words whose orthographic outline needs several strokes (and without
+a single stroke entry in the dictionaries), look for unused strokes
+(neither in the dictionaries, nor translated by the orthography) derived
+from that outline. Candidates are scored by the number of strokes saved,
+weighted by the word frequency, and assigned best first, so suggestions
+never collide with each other.
+'''
+
+import argparse
+import itertools
+import sys
+
+from plover_melani import system
+from plover_melani.scripts._common import (
+    MAIN_DICTIONARY,
+    add_jobs_argument, build_index, chunked, imap,
+    load_dictionaries, load_frequencies, worker_pool,
+)
+from plover_melani.theory import Stroke, Theory
+
+
+_STAR_KEY = 1 << system.KEYS.index('*')
+_NUMBER_KEY = 1 << system.KEYS.index(system.NUMBER_KEY)
+
+
+def brief_candidates(outline):
+    ''' Return the candidate briefs for `outline` (a list of
+    integer strokes), most relevant first.
+    '''
+    first = outline[0]
+    merged = 0
+    for stroke in outline:
+        merged |= stroke
+    candidates = []
+    for base in [merged] + [first | stroke for stroke in outline[:0:-1]]:
+        for stroke in (base, base | _STAR_KEY):
+            if not stroke & _NUMBER_KEY and stroke not in candidates:
+                candidates.append(stroke)
+    return candidates
+
+
+# Workers state. {{{
+
+_theory = None
+_index = None
+_used_strokes = None
+# Free strokes bitmap (indexed by the stroke integer bitmask), filled
+# on demand: 0 if unknown yet, 1 if free, 2 if already used.
+_free_strokes = None
+
+def _init_worker(dictionaries_filenames):
+    global _theory, _index, _used_strokes, _free_strokes
+    dictionaries = load_dictionaries(dictionaries_filenames)
+    _theory = Theory()
+    _index = build_index(dictionaries)
+    _used_strokes = set()
+    for dictionary in dictionaries:
+        for steno in dictionary:
+            for s in steno.split('/'):
+                try:
+                    _used_strokes.add(int(Stroke(s)))
+                except ValueError:
+                    pass
+    _free_strokes = bytearray(1 << len(system.KEYS))
+
+def _is_free(stroke):
+    state = _free_strokes[stroke]
+    if not state:
+        state = 2
+        if stroke not in _used_strokes:
+            try:
+                _theory.translate_stroke(stroke)
+            except KeyError:
+                state = 1
+        _free_strokes[stroke] = state
+    return state == 1
+
+def score_word(word, count):
+    ''' Return `(score, word, outline, candidates)` for `word`,
+    or `None` if it's not worth a brief (or none is available).
+    '''
+    if _index.get(word) == 1:
+        return None
+    outline = _theory.strokes_from_text(word)
+    if len(outline) < 2:
+        return None
+    candidates = [
+        stroke
+        for stroke in brief_candidates([int(s) for s in outline])
+        if _is_free(stroke)
+    ]
+    if not candidates:
+        return None
+    return (count * (len(outline) - 1), word,
+            '/'.join(str(s) for s in outline), candidates)
+
+def _score_words(words):
+    return [
+        result
+        for result in itertools.starmap(score_word, words)
+        if result is not None
+    ]
+
+# }}}
+
+
+def suggest_briefs(words, dictionaries_filenames, jobs=1, chunk_size=1000):
+    ''' Return a list of `(brief, word, outline, score)`, best first. '''
+    with worker_pool(jobs, _init_worker, (dictionaries_filenames,)) as pool:
+        scored = list(itertools.chain.from_iterable(
+            imap(pool, _score_words, chunked(words, chunk_size), jobs)))
+    # Note: stable sort, so equal scores keep the input order.
+    scored.sort(key=lambda result: result[0], reverse=True)
+    assigned = set()
+    suggested = set()
+    suggestions = []
+    for score, word, outline, candidates in scored:
+        if word in suggested:
+            continue
+        for stroke in candidates:
+            if stroke not in assigned:
+                assigned.add(stroke)
+                suggested.add(word)
+                suggestions.append((str(Stroke.from_integer(stroke)),
+                                    word, outline, score))
+                break
+    return suggestions
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Suggest single stroke briefs for frequent words.')
+    parser.add_argument('-d', '--dictionary', metavar='FILE', action='append',
+                        help='dictionary to check for used strokes (can be '
+                        'repeated, default: the bundled main dictionary)')
+    add_jobs_argument(parser)
+    parser.add_argument('--chunk-size', metavar='N', type=int, default=1000,
+                        help='number of words per chunk (default: %(default)s)')
+    parser.add_argument('-n', '--limit', metavar='N', type=int,
+                        help='maximum number of suggestions')
+    parser.add_argument('words', metavar='FILE',
+                        help='word frequency list (`-` for stdin)')
+    args = parser.parse_args()
+    words = load_frequencies(args.words)
+    suggestions = suggest_briefs(words, args.dictionary or [MAIN_DICTIONARY],
+                                 args.jobs, args.chunk_size)
+    for brief, word, outline, score in suggestions[:args.limit]:
+        sys.stdout.write('%s\t%s\t%s\t%g\n' % (brief, word, outline, score))
+
+
+if __name__ == '__main__':
+    run()
+
+# vim: foldmethod=marker
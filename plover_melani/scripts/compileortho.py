@@ -0,0 +1,158 @@
+''' Compile the orthography into a static steno dictionary.
+
+Every stroke the theory can translate is written to a compact binary
+table (`--binary`), and/or a sorted JSON dictionary (`--json`; note:
+this one is big, e.g. ~114MB for the bundled orthography).
+
+The binary table is made of:
+
+- header: magic (`MLNO`), version, number of keys, and number of entries
+  (4 little-endian unsigned 32 bits integers each)
+- index: the sorted strokes (as integer bitmasks), followed by
+  `number of entries + 1` offsets into the translations data
+- translations data: the (UTF-8 encoded) translations, in the same order
+
+so a lookup is a binary search, then 2 array accesses, see `Table`.
+Note: translations are not deduplicated, as nearly all of them are unique.
+'''
+
+from array import array
+import argparse
+import bisect
+import json
+import struct
+import sys
+import time
+
+from plover_melani import system
+from plover_melani.steno import sort_key, stroke_steno
+from plover_melani.theory import Theory
+
+
+MAGIC = b'MLNO'
+VERSION = 2
+
+_HEADER = struct.Struct('<4sIII')
+
+
+class Table:
+    ''' Read access to a binary table. '''
+
+    def __init__(self, data):
+        magic, version, nb_keys, nb_entries = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('invalid table')
+        if nb_keys != len(system.KEYS):
+            raise ValueError('table keys mismatch')
+        arrays = []
+        offset = _HEADER.size
+        for size in (nb_entries, nb_entries + 1):
+            values = array('I')
+            values.frombytes(data[offset:offset + 4 * size])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            arrays.append(values)
+            offset += 4 * size
+        self._strokes, self._offsets = arrays
+        self._data = data[offset:]
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fp:
+            return cls(fp.read())
+
+    def __len__(self):
+        return len(self._strokes)
+
+    def __getitem__(self, stroke):
+        stroke = int(stroke)
+        n = bisect.bisect_left(self._strokes, stroke)
+        if n == len(self._strokes) or self._strokes[n] != stroke:
+            raise KeyError(stroke)
+        start, end = self._offsets[n], self._offsets[n + 1]
+        return self._data[start:end].decode('utf-8')
+
+
+def compile_theory(theory):
+    ''' Return the list of `(stroke, translation)` for every stroke
+    `theory` can translate, with `stroke` an integer bitmask, sorted
+    by stroke.
+    '''
+    return sorted(theory.iter_translations())
+
+
+def write_json(fp, entries):
+    ''' Write `entries` to `fp` (a binary file), sorted and formatted
+    like `melani_sortdict` does.
+    '''
+    if not entries:
+        fp.write(b'{}')
+        return
+    entries = sorted(entries, key=lambda entry: sort_key(entry[0]))
+    encode = json.encoder.encode_basestring
+    fp.write(b'{\n')
+    for start in range(0, len(entries), 10000):
+        if start:
+            fp.write(b',\n')
+        fp.write(',\n'.join(
+            '%s: %s' % (encode(stroke_steno(stroke)), encode(translation))
+            for stroke, translation in entries[start:start + 10000]
+        ).encode('utf-8'))
+    fp.write(b'\n}')
+
+
+def write_binary(fp, entries):
+    ''' Write `entries` (sorted by stroke) to `fp`
+    (a binary file) as a binary table.
+    '''
+    strokes = array('I')
+    offsets = array('I', [0])
+    data = []
+    size = 0
+    for stroke, translation in entries:
+        encoded = translation.encode('utf-8')
+        data.append(encoded)
+        size += len(encoded)
+        strokes.append(stroke)
+        offsets.append(size)
+    fp.write(_HEADER.pack(MAGIC, VERSION, len(system.KEYS), len(strokes)))
+    for values in (strokes, offsets):
+        if sys.byteorder == 'big':
+            values.byteswap()
+        fp.write(values.tobytes())
+    fp.write(b''.join(data))
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Compile the Melani orthography into a static dictionary.')
+    parser.add_argument('--orthography', metavar='FILE',
+                        help='orthography to compile (default: the one '
+                        'in use by Plover)')
+    parser.add_argument('--binary', metavar='FILE',
+                        help='write a binary table to FILE')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write a (sorted) JSON dictionary to FILE '
+                        '(note: it is several times bigger than the binary table)')
+    args = parser.parse_args()
+    if args.json is None and args.binary is None:
+        parser.error('at least one of --binary or --json is required')
+    start = time.perf_counter()
+    if args.orthography is None:
+        theory = Theory()
+    else:
+        with open(args.orthography, encoding='utf-8') as fp:
+            theory = Theory(json.load(fp))
+    entries = compile_theory(theory)
+    if args.json is not None:
+        with open(args.json, 'wb') as fp:
+            write_json(fp, entries)
+    if args.binary is not None:
+        with open(args.binary, 'wb') as fp:
+            write_binary(fp, entries)
+    sys.stderr.write('%u strokes compiled in %.1fs\n' % (
+        len(entries), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,168 @@
+''' Coverage and stroke efficiency of the main dictionary and the
+orthography on a plain text corpus.
+
+The corpus is streamed (in chunks, tokenized in parallel), so memory
+use only depends on the vocabulary size, not the corpus size. Each
+distinct word is then looked up (once) in the main dictionary (through
+an inverted index), and if not found reverse looked up with the theory.
+'''
+
+from collections import Counter
+import argparse
+import sys
+
+from plover_melani.scripts._common import (
+    MAIN_DICTIONARY, WORD_RX,
+    add_jobs_argument, build_index, chunked, imap,
+    load_dictionaries, worker_pool,
+)
+from plover_melani.theory import Theory
+
+
+def tokenize(text):
+    return WORD_RX.findall(text.replace('’', "'"))
+
+
+# Workers state. {{{
+
+_index = None
+_theory = None
+
+def _init_worker(dictionaries_filenames):
+    global _index, _theory
+    _index = build_index(load_dictionaries(dictionaries_filenames))
+    _theory = Theory()
+
+def _count_words(text):
+    return Counter(tokenize(text))
+
+def resolve_word(word):
+    ''' Return `(source, nb_strokes)` for `word`, with source `'dictionary'`,
+    `'orthography'`, or `None` if unwritable.
+    '''
+    for candidate in (word, word.lower()):
+        nb_strokes = _index.get(candidate)
+        if nb_strokes is not None:
+            return 'dictionary', nb_strokes
+    for candidate in (word, word.lower()):
+        stroke_list = _theory.strokes_from_text(candidate)
+        if stroke_list:
+            return 'orthography', len(stroke_list)
+    return None, 0
+
+def _resolve_words(words):
+    return [(word,) + resolve_word(word) for word in words]
+
+# }}}
+
+
+def _read_text_chunks(fp, chunk_size):
+    leftover = ''
+    while True:
+        data = fp.read(chunk_size)
+        if not data:
+            break
+        data = leftover + data
+        # Don't split a word across chunks.
+        end = len(data)
+        while end and (data[end - 1].isalpha() or data[end - 1] in "'’"):
+            end -= 1
+        leftover = data[end:]
+        if end:
+            yield data[:end]
+    if leftover:
+        yield leftover
+
+
+def analyze(files, dictionaries_filenames, jobs=1, chunk_size=1 << 20):
+    ''' Return `(counts, resolved)`: the number of occurrences of
+    each word in `files`, and the result of `resolve_word` for
+    each of those words.
+    '''
+    with worker_pool(jobs, _init_worker, (dictionaries_filenames,)) as pool:
+        counts = Counter()
+        for fp in files:
+            for chunk_counts in imap(pool, _count_words,
+                                     _read_text_chunks(fp, chunk_size), jobs):
+                counts.update(chunk_counts)
+        resolved = {}
+        for chunk in imap(pool, _resolve_words, chunked(counts, 1000), jobs):
+            for word, source, nb_strokes in chunk:
+                resolved[word] = (source, nb_strokes)
+    return counts, resolved
+
+
+def report(counts, resolved, top=50, fp=None):
+    if fp is None:
+        fp = sys.stdout
+    total = sum(counts.values())
+    tokens = Counter()
+    strokes = Counter()
+    for word, count in counts.items():
+        source, nb_strokes = resolved[word]
+        tokens[source] += count
+        strokes[source] += count * nb_strokes
+    def percent(n):
+        return 100.0 * n / total if total else 0
+    def per_word(source_list):
+        nb_tokens = sum(tokens[s] for s in source_list)
+        nb_strokes = sum(strokes[s] for s in source_list)
+        return nb_strokes / nb_tokens if nb_tokens else 0
+    fp.write('%u words (%u distinct)\n' % (total, len(counts)))
+    fp.write('coverage: %.2f%% (dictionary: %.2f%%, orthography: %.2f%%), '
+             'unwritable: %.2f%%\n' % (
+                 percent(tokens['dictionary'] + tokens['orthography']),
+                 percent(tokens['dictionary']), percent(tokens['orthography']),
+                 percent(tokens[None])))
+    fp.write('strokes/word: %.2f (dictionary: %.2f, orthography: %.2f)\n' % (
+        per_word(('dictionary', 'orthography')),
+        per_word(('dictionary',)), per_word(('orthography',))))
+    unwritable = Counter({
+        word: count
+        for word, count in counts.items()
+        if resolved[word][0] is None
+    })
+    if top and unwritable:
+        fp.write('most frequent unwritable words:\n')
+        for word, count in unwritable.most_common(top):
+            fp.write('%10u %s\n' % (count, word))
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Report the coverage and stroke efficiency of the '
+        'Melani main dictionary and orthography on a plain text corpus.')
+    parser.add_argument('-d', '--dictionary', metavar='FILE', action='append',
+                        help='dictionary to use (can be repeated, '
+                        'default: the bundled main dictionary)')
+    add_jobs_argument(parser)
+    parser.add_argument('--chunk-size', metavar='N', type=int, default=1 << 20,
+                        help='number of characters per chunk '
+                        '(default: %(default)s)')
+    parser.add_argument('--top', metavar='N', type=int, default=50,
+                        help='number of unwritable words to list, '
+                        'most frequent first (default: %(default)s)')
+    parser.add_argument('corpus', metavar='FILE', nargs='+',
+                        help='corpus file (`-` for stdin)')
+    args = parser.parse_args()
+    dictionaries_filenames = args.dictionary or [MAIN_DICTIONARY]
+    files = []
+    try:
+        for filename in args.corpus:
+            if filename == '-':
+                files.append(sys.stdin)
+            else:
+                files.append(open(filename, encoding='utf-8', errors='replace'))
+        counts, resolved = analyze(files, dictionaries_filenames,
+                                   args.jobs, args.chunk_size)
+    finally:
+        for fp in files:
+            if fp is not sys.stdin:
+                fp.close()
+    report(counts, resolved, args.top)
+
+
+if __name__ == '__main__':
+    run()
+
+# vim: foldmethod=marker
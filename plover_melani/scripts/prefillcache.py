@@ -0,0 +1,92 @@
+''' Prefill the persistent reverse lookup cache from a word list,
+see `plover_melani.reverse_cache`.
+
+Words already cached are skipped, the others are reverse looked up in
+parallel, and the results written (in batches) by the main process.
+'''
+
+import argparse
+import os
+import sys
+import time
+
+from plover_melani.reverse_cache import (
+    ReverseLookupCache,
+    cache_filename,
+    cache_key,
+    search_outlines,
+)
+from plover_melani.scripts._common import (
+    add_jobs_argument, chunked, imap, load_frequencies, worker_pool,
+)
+from plover_melani.theory import Theory
+
+
+# Same default as `melani_orthography`.
+REVERSE_LOOKUP_COUNT = int(os.environ.get('PLOVER_MELANI_REVERSE_LOOKUP_COUNT', 5))
+
+
+# Workers state. {{{
+
+_theory = None
+_count = None
+
+def _init_worker(count):
+    global _theory, _count
+    _theory = Theory()
+    _count = count
+
+def _search_words(words):
+    # Note: the results of incomplete searches are not cached.
+    results = []
+    for word in words:
+        outlines, complete = search_outlines(_theory, word, _count)
+        if complete:
+            results.append((word, outlines))
+    return results
+
+# }}}
+
+
+def prefill(words, filename=None, count=REVERSE_LOOKUP_COUNT,
+            jobs=1, chunk_size=1000):
+    ''' Cache the reverse lookups of `words`, return `(cached, added,
+    skipped)`: the number of words already cached, newly added, and
+    skipped (because their search was cut short, e.g. when overloaded).
+    '''
+    words = list(dict.fromkeys(words))
+    with ReverseLookupCache(cache_key(Theory(), count), filename) as cache, \
+         worker_pool(jobs, _init_worker, (count,)) as pool:
+        missing = [word for word in words if cache.get(word) is None]
+        added = 0
+        for chunk in imap(pool, _search_words, chunked(missing, chunk_size), jobs):
+            cache.put_many(chunk)
+            added += len(chunk)
+    return len(words) - len(missing), added, len(missing) - added
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Prefill the Melani persistent reverse lookup cache.')
+    add_jobs_argument(parser)
+    parser.add_argument('--chunk-size', metavar='N', type=int, default=1000,
+                        help='number of words per chunk (default: %(default)s)')
+    parser.add_argument('--cache', metavar='FILE', default=cache_filename(),
+                        help='cache database (default: %(default)s)')
+    parser.add_argument('words', metavar='FILE',
+                        help='word list, one per line, e.g. a word '
+                        'frequency list (`-` for stdin)')
+    args = parser.parse_args()
+    words = load_frequencies(args.words)
+    start = time.perf_counter()
+    cached, added, skipped = prefill([word for word, count in words], args.cache,
+                            jobs=args.jobs, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - start
+    sys.stderr.write('%u words already cached, %u added in %.3fs, %u skipped '
+                     '(incomplete search)\n' % (cached, added, elapsed, skipped))
+
+
+if __name__ == '__main__':
+    run()
+
+# vim: foldmethod=marker
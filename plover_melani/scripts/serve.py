@@ -0,0 +1,40 @@
+''' Serve Melani lookups on a Unix socket, see `plover_melani.service`. '''
+
+import argparse
+import asyncio
+import sys
+
+from plover_melani.scripts._common import MAIN_DICTIONARY, load_dictionaries
+from plover_melani.service import Server, default_socket_path
+from plover_melani.theory import Theory
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Serve Melani orthography (and dictionaries) lookups '
+        'on a Unix socket, using JSON lines.')
+    parser.add_argument('-s', '--socket', metavar='PATH',
+                        default=default_socket_path(),
+                        help='socket path (default: %(default)s)')
+    parser.add_argument('-d', '--dictionary', metavar='FILE', action='append',
+                        help='dictionary to load for `lookup` requests (can '
+                        'be repeated, last has priority)')
+    parser.add_argument('--main-dictionary', action='store_true',
+                        help='load the bundled main dictionary '
+                        '(before other dictionaries)')
+    args = parser.parse_args()
+    dictionaries_filenames = args.dictionary or []
+    if args.main_dictionary:
+        dictionaries_filenames.insert(0, MAIN_DICTIONARY)
+    server = Server(Theory(), load_dictionaries(dictionaries_filenames))
+    sys.stderr.write('listening on %s\n' % args.socket)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        sys.exit('error: %s' % e)
+
+
+if __name__ == '__main__':
+    run()
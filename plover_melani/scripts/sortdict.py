@@ -1,49 +1,112 @@
 from collections import OrderedDict
-from io import open
+import argparse
 import json
 import sys
 
-from plover_melani.theory import Stroke, Theory
+from plover_melani.scripts._common import add_jobs_argument, imap, worker_pool
+from plover_melani.steno import parse_stroke, sort_key, stroke_steno
+from plover_melani.theory import Theory
 
 
-def run():
-    theory = Theory()
-    if len(sys.argv) == 1:
-        print('usage: %s [-s] DICTIONARIES..')
-        return
-    if sys.argv[1] == '-s':
-        strip = True
-        args = sys.argv[2:]
-    else:
-        strip = False
-        args = sys.argv[1:]
-    for filename in args:
-        with open(filename, encoding='utf-8') as fp:
-            dictionary = dict(
-                (tuple(Stroke(s) for s in k.split('/')), v)
-                for k, v in json.load(fp).items()
-            )
-        if strip:
-            for stroke_list, translation in list(dictionary.items()):
-                if len(stroke_list) != 1:
-                    continue
-                try:
-                    orthographic_translation = theory.translate_stroke(stroke_list[0])
-                except KeyError:
-                    continue
-                if orthographic_translation == translation:
-                    del dictionary[stroke_list]
-        sorted_dictionary = OrderedDict(
-            ('/'.join(str(s) for s in k), v)
-            for k, v in sorted(dictionary.items())
+_theory = None
+
+
+def _init_worker(strip):
+    global _theory
+    if strip:
+        _theory = Theory()
+
+
+def _parse_stroke(steno):
+    ''' Parse `steno`, and return a `(sort_key, stroke, canonical_steno)` tuple. '''
+    stroke = parse_stroke(steno)
+    return sort_key(stroke), stroke, stroke_steno(stroke)
+
+
+def process_dictionary(filename, check=False):
+    ''' Sort (and strip of orthographic entries, if a theory was loaded
+    in this process) the dictionary `filename`.
+
+    The dictionary is only rewritten if its contents change, and never
+    in `check` mode. Return `(filename, changed, redundant)`, with
+    `redundant` the number of stripped entries. Raise `ValueError` if
+    different entries have the same canonical steno (e.g. `#S` and `1`).
+    '''
+    with open(filename, 'rb') as fp:
+        original_contents = fp.read()
+    dictionary = {}
+    sources = {}
+    for steno, translation in json.loads(original_contents.decode('utf-8')).items():
+        stroke_list = tuple(_parse_stroke(s) for s in steno.split('/'))
+        if stroke_list in sources:
+            raise ValueError('%s: duplicate entries for %s (%s and %s)' % (
+                filename, '/'.join(s[2] for s in stroke_list),
+                sources[stroke_list], steno))
+        sources[stroke_list] = steno
+        dictionary[stroke_list] = translation
+    redundant = 0
+    if _theory is not None:
+        single_strokes = [k for k in dictionary if len(k) == 1]
+        orthographic_translations, __ = _theory.translate_many(
+            stroke_list[0][1] for stroke_list in single_strokes
         )
-        contents = json.dumps(sorted_dictionary,
-                              indent=0,
-                              sort_keys=False,
-                              ensure_ascii=False,
-                              separators=(',', ': '))
+        for stroke_list, orthographic_translation in zip(single_strokes,
+                                                         orthographic_translations):
+            if orthographic_translation == dictionary[stroke_list]:
+                del dictionary[stroke_list]
+                redundant += 1
+    sorted_dictionary = OrderedDict(
+        ('/'.join(s[2] for s in k), v)
+        for k, v in sorted(dictionary.items(),
+                           key=lambda item: tuple(s[0] for s in item[0]))
+    )
+    contents = json.dumps(sorted_dictionary,
+                          indent=0,
+                          sort_keys=False,
+                          ensure_ascii=False,
+                          separators=(',', ': ')).encode('utf-8')
+    changed = contents != original_contents
+    if changed and not check:
         with open(filename, 'wb') as fp:
-            fp.write(contents.encode('utf-8'))
+            fp.write(contents)
+    return filename, changed, redundant
+
+
+def _process_dictionary(args):
+    return process_dictionary(*args)
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Sort Melani dictionaries (in place).')
+    parser.add_argument('-s', '--strip', action='store_true',
+                        help='remove entries already provided by the orthography')
+    parser.add_argument('--check', action='store_true',
+                        help='only report dictionaries that are not sorted '
+                        '(or with redundant entries), do not write anything; '
+                        'exit with a non-zero status if any')
+    add_jobs_argument(parser)
+    parser.add_argument('dictionaries', metavar='DICTIONARY', nargs='+')
+    args = parser.parse_args()
+    tasks = [(filename, args.check) for filename in args.dictionaries]
+    jobs = min(args.jobs, len(tasks))
+    try:
+        with worker_pool(jobs, _init_worker, (args.strip,)) as pool:
+            results = list(imap(pool, _process_dictionary, tasks, jobs))
+    except ValueError as e:
+        sys.exit('error: %s' % e)
+    if not args.check:
+        return
+    status = 0
+    for filename, changed, redundant in results:
+        if not changed:
+            continue
+        status = 1
+        if redundant:
+            print('%s: %u redundant entries' % (filename, redundant))
+        else:
+            print('%s: not sorted' % filename)
+    sys.exit(status)
 
 
 if __name__ == '__main__':
@@ -1,17 +1,157 @@
+import argparse
 import sys
+import time
 
-from plover_melani.theory import Stroke, Theory
+from plover_melani.scripts._common import (
+    add_jobs_argument, chunked, imap, worker_pool,
+)
+from plover_melani.service import Client, default_socket_path
+from plover_melani.steno import format_steno, parse_steno
+from plover_melani.theory import Theory
 
 
-theory = Theory()
+# Bulk mode helpers. {{{
+
+_theory = None
+
+def _init_worker():
+    global _theory
+    _theory = Theory()
+
+def _steno_to_text(steno):
+    try:
+        stroke_list = parse_steno(steno)
+        text = _theory.strokes_to_text(stroke_list)
+    except (KeyError, ValueError):
+        return None, 0
+    return text, len(stroke_list)
+
+def _text_to_steno(text):
+    stroke_list = _theory.strokes_from_text(text)
+    if not stroke_list:
+        return None, 0
+    return format_steno(stroke_list), len(stroke_list)
+
+def _process_chunk(args):
+    convert, lines = args
+    return [(line,) + convert(line) for line in lines]
+
+def _remote_results(client, convert, chunks):
+    ''' Like `_process_chunk`, but using a `melani_serve` server. '''
+    for chunk in chunks:
+        if convert is _steno_to_text:
+            results = client.strokes_to_text(chunk)
+            outlines = chunk
+        else:
+            results = outlines = client.strokes_from_text(chunk)
+        yield [
+            (line, result, 0 if result is None else outline.count('/') + 1)
+            for line, result, outline in zip(chunk, results, outlines)
+        ]
+
+def _run_bulk(fp, convert, jobs, chunk_size, client=None):
+    ''' Convert each line from `fp`, writing tab-separated results
+    to stdout (an empty output for unresolvable inputs), and a
+    summary to stderr.
+
+    If `client` is provided, conversions are done by the server.
+    '''
+    count = unresolved = strokes = 0
+    start = time.perf_counter()
+    lines = (line.strip() for line in fp)
+    chunks = chunked((line for line in lines if line), chunk_size)
+    # Note: no workers (or theory) needed when using a server.
+    with worker_pool(1 if client else jobs,
+                     None if client else _init_worker) as pool:
+        if client is not None:
+            results = _remote_results(client, convert, chunks)
+        else:
+            results = imap(pool, _process_chunk,
+                           ((convert, chunk) for chunk in chunks), jobs)
+        for chunk in results:
+            output = []
+            for line, converted, nb_strokes in chunk:
+                if converted is None:
+                    unresolved += 1
+                    converted = ''
+                output.append('%s\t%s\n' % (line, converted))
+                strokes += nb_strokes
+            count += len(chunk)
+            sys.stdout.write(''.join(output))
+    elapsed = time.perf_counter() - start
+    resolved = count - unresolved
+    sys.stderr.write('%u words in %.3fs (%.0f words/s), %u unresolvable, '
+                     '%.2f strokes/word\n' % (
+                         count, elapsed, count / elapsed if elapsed else 0,
+                         unresolved, strokes / resolved if resolved else 0))
+
+# }}}
 
 # Main entry-point for testing. {{{
 
-def run():
-    if len(sys.argv) > 1 and sys.argv[1] == '/':
+def run(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description='Convert text to steno (or steno to text when the '
+        'first argument is `/`) using the Melani orthography.')
+    parser.add_argument('words', metavar='WORD', nargs='*',
+                        help='words to convert')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--stdin', action='store_true',
+                        help='read words (one per line) from stdin')
+    source.add_argument('--file', metavar='FILE',
+                        help='read words (one per line) from FILE')
+    add_jobs_argument(parser, 'bulk mode')
+    parser.add_argument('--chunk-size', metavar='N', type=int, default=1000,
+                        help='number of words per chunk (in bulk mode, '
+                        'default: %(default)s)')
+    parser.add_argument('--server', metavar='SOCKET', nargs='?',
+                        const=default_socket_path(),
+                        help='use a `melani_serve` server, instead of '
+                        'building the theory (default socket: %(const)s)')
+    # Note: arguments following `/` are steno, not options (e.g.
+    # right bank only strokes like `-Es` start with a dash).
+    to_text = '/' in argv
+    if to_text:
+        index = argv.index('/')
+        argv, words = argv[:index], argv[index + 1:]
+    args = parser.parse_args(argv)
+    if to_text:
+        if args.words:
+            parser.error('words arguments must follow `/` in steno mode')
+    else:
+        words = args.words
+    if args.stdin or args.file is not None:
+        if words:
+            parser.error('words arguments are not supported in bulk mode')
+        convert = _steno_to_text if to_text else _text_to_steno
+        client = None if args.server is None else Client(args.server)
+        try:
+            if args.stdin:
+                _run_bulk(sys.stdin, convert, args.jobs, args.chunk_size, client)
+            else:
+                with open(args.file, encoding='utf-8') as fp:
+                    _run_bulk(fp, convert, args.jobs, args.chunk_size, client)
+        finally:
+            if client is not None:
+                client.close()
+        return
+    if args.server is not None:
+        with Client(args.server) as client:
+            if to_text:
+                results = client.strokes_to_text(words)
+                print(''.join(steno if text is None else text
+                              for steno, text in zip(words, results)))
+            else:
+                print(''.join(steno or ''
+                              for steno in client.strokes_from_text(words)))
+        return
+    theory = Theory()
+    if to_text:
         # steno -> text.
-        for steno in sys.argv[2:]:
-            stroke_list = [Stroke(s) for s in steno.split('/')]
+        for steno in words:
+            stroke_list = parse_steno(steno)
             try:
                 text = theory.strokes_to_text(stroke_list)
             except KeyError:
@@ -20,10 +160,9 @@ def run():
         print()
     else:
         # text -> steno.
-        for text in sys.argv[1:]:
+        for text in words:
             stroke_list = theory.strokes_from_text(text)
-            steno = '/'.join(str(s) for s in stroke_list)
-            print(steno, end='')
+            print(format_steno(stroke_list), end='')
         print()
 
 
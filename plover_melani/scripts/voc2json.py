@@ -1,9 +1,15 @@
 from collections import namedtuple, OrderedDict
+import argparse
 import csv
 import json
 import re
 import sys
+import time
 
+from plover_melani.scripts._common import (
+    add_jobs_argument, chunked, imap, worker_pool,
+)
+from plover_melani.steno import format_steno, parse_steno
 from plover_melani.theory import Stroke, Theory
 
 
@@ -11,34 +17,34 @@ def warning(fmt, *args):
     sys.stderr.write('warning: ' + (fmt % args) + '\n')
 
 
+# Note: entities are replaced in 2 passes, so `&amp;` escaping
+# behaves as it did with the original chain of replacements.
+ENTITIES_RX = (
+    re.compile(r'&(dw|1uc|amp);'),
+    re.compile(r'&(cr|lc|rb|sp|uc);'),
+)
+ENTITIES = {
+    'dw' : '{-}'         , # undo
+    '1uc': '{-|}'        ,
+    'amp': '&'           ,
+    'cr' : '{#Return}'   ,
+    'lc' : '{MODE:RESET}', # lowercase
+    'rb' : '{^}'         ,
+    'sp' : ' '           ,
+    'uc' : '{MODE:CAPS}' , # UPPERCASE
+}
+VAR_RX = re.compile(r'&var;\|([^|]*)\|([^|]*)\|([^|]*)\|')
+
+
 class StrokeList(tuple):
 
     def __new__(cls, steno):
         if not isinstance(steno, str):
             return tuple.__new__(cls, steno)
-        for old, new in (
-            ('\\', '/'),
-            ('$', '#'),
-        ):
-            steno = steno.replace(old, new)
-        stroke_list = []
-        for stroke in steno.split('/'):
-            keys = []
-            for k in stroke:
-                if k in '#*':
-                    pass
-                elif k in 'SPCTHVRIA':
-                    k = k + '-'
-                elif k in 'EOcsthprieao':
-                    k = '-' + k
-                else:
-                    raise Exception('invalid key: %s' % k)
-                keys.append(k)
-            stroke_list.append(Stroke(keys))
-        return tuple.__new__(cls, stroke_list)
+        return tuple.__new__(cls, parse_steno(steno))
 
     def __str__(self):
-        return '/'.join(str(s) for s in self)
+        return format_steno(self)
 
 
 class Translation(namedtuple('Translation', 'text word_finished add_space')):
@@ -46,21 +52,14 @@ class Translation(namedtuple('Translation', 'text word_finished add_space')):
     def __new__(cls, text, word_finished=None, add_space=None):
         if word_finished is not None:
             return super(Translation, cls).__new__(cls, text, word_finished, add_space)
-        for old, new in (
-            ('&dw;' , '{-}'         ), # undo
-            ('&1uc;', '{-|}'        ),
-            ('&amp;', '&'           ),
-            ('&cr;' , '{#Return}'   ),
-            ('&lc;' , '{MODE:RESET}'), # lowercase
-            ('&rb;' , '{^}'         ),
-            ('&sp;' , ' '           ),
-            ('&uc;' , '{MODE:CAPS}' ), # UPPERCASE
-        ):
-            text = text.replace(old, new)
+        if '&' in text:
+            for rx in ENTITIES_RX:
+                text = rx.sub(cls._replace_entity, text)
         if '&+i;' in text:
             word_finished = True
             text = text.replace('&+i;', '')
-        text = re.sub(r'&var;\|([^|]*)\|([^|]*)\|([^|]*)\|', cls._replace_var, text)
+        if '&var;' in text:
+            text = VAR_RX.sub(cls._replace_var, text)
         if text.endswith(' '):
             add_space = True
             word_finished = True
@@ -75,6 +74,10 @@ class Translation(namedtuple('Translation', 'text word_finished add_space')):
             add_space = False
         return super(Translation, cls).__new__(cls, text, word_finished, add_space)
 
+    @staticmethod
+    def _replace_entity(match):
+        return ENTITIES[match.group(1)]
+
     @staticmethod
     def _replace_var(match):
         else_translation = match.group(1)
@@ -130,7 +133,47 @@ class Translation(namedtuple('Translation', 'text word_finished add_space')):
         return s
 
 
-def load_database(filename, model=1, filter_out_number_strokes=True):
+def _is_number_stroke(stroke):
+    return (stroke & '#') != 0 and (stroke & ~Stroke('#SPTVIOctpi')) == 0
+
+
+def convert_rows(rows, filter_out_number_strokes=True):
+    ''' Convert database rows to `(stroke_list, translation1, translation2, readonly)` entries. '''
+    entries = []
+    for row in rows:
+        steno = row[0]
+        text1 = row[1]
+        text2 = row[2]
+        readonly = int(row[3]) != 0
+        stroke_list = StrokeList(steno)
+        translation1 = Translation(text1) if text1 else None
+        translation2 = Translation(text2) if text2 else None
+        if filter_out_number_strokes and len(stroke_list) == 1:
+            if _is_number_stroke(stroke_list[0]):
+                if translation1 is not None:
+                    assert re.match(r'^\d+$', translation1.text)
+                if translation2 is not None:
+                    assert re.match(r'^\d+$', translation2.text)
+                continue
+        entries.append((stroke_list, translation1, translation2, readonly))
+    return entries
+
+
+def _convert_chunk(args):
+    rows, filter_out_number_strokes = args
+    return len(rows), convert_rows(rows, filter_out_number_strokes)
+
+
+def load_database(filename, model=1, filter_out_number_strokes=True,
+                  jobs=1, chunk_size=5000, progress=False):
+    ''' Load a vocabulary database.
+
+    Rows are read and converted in chunks of `chunk_size`, in parallel
+    if `jobs` > 1; entries are still classified in database order, so
+    the result (and warnings) do not depend on the number of jobs.
+
+    If `progress` is true, report throughput on stderr.
+    '''
 
     combos_fragments = {}
     prefix_dictionary = {}
@@ -161,54 +204,51 @@ def load_database(filename, model=1, filter_out_number_strokes=True):
         else:
             suffix_dictionary[stroke_list] = translation
 
-    with open(filename) as fp:
+    with open(filename, encoding='utf-8', newline='') as fp:
         reader = csv.reader(fp)
         assert len(next(reader)) == 5
-        for row in reader:
-            row = [str(cell, 'UTF-8') for cell in row]
-            steno = row[0]
-            text1 = row[1]
-            text2 = row[2]
-            readonly = int(row[3]) != 0
-            stroke_list = StrokeList(steno)
-            translation1 = Translation(text1) if text1 else None
-            translation2 = Translation(text2) if text2 else None
-            if filter_out_number_strokes and len(stroke_list) == 1:
-                stroke = stroke_list[0]
-                if (stroke & '#') != 0 and (stroke & ~Stroke('#SPTVIOctpi')) == 0:
-                    if translation1 is not None:
-                        assert re.match(r'^\d+$', translation1.text)
-                    if translation2 is not None:
-                        assert re.match(r'^\d+$', translation2.text)
-                    continue
-            # print('%d %-20s %-50.50s %-50.50s' % (
-            #     1 if readonly else 0, stroke_list,
-            #     translation1, translation2))
-            if model == 1:
-                if readonly == 0:
-                    if translation1 is not None:
-                        add_suffix(stroke_list, translation1)
-                    if translation2 is not None:
-                        add_fragment(stroke_list, translation2)
-                else:
-                    if translation1 is not None:
-                        add_prefix(stroke_list, translation1)
-                    if translation2 is not None:
-                        add_fragment(stroke_list, translation2)
-            elif model == 2:
-                if translation1 is not None:
-                    add_prefix(stroke_list, translation1)
-                if translation2 is not None:
-                    add_fragment(stroke_list, translation2)
+        tasks = ((chunk, filter_out_number_strokes)
+                 for chunk in chunked(reader, chunk_size))
+        nb_rows = 0
+        start = time.perf_counter()
+        with worker_pool(jobs) as pool:
+            for chunk_rows, entries in imap(pool, _convert_chunk, tasks, jobs):
+                for stroke_list, translation1, translation2, readonly in entries:
+                    # print('%d %-20s %-50.50s %-50.50s' % (
+                    #     1 if readonly else 0, stroke_list,
+                    #     translation1, translation2))
+                    if model == 1:
+                        if readonly == 0:
+                            if translation1 is not None:
+                                add_suffix(stroke_list, translation1)
+                            if translation2 is not None:
+                                add_fragment(stroke_list, translation2)
+                        else:
+                            if translation1 is not None:
+                                add_prefix(stroke_list, translation1)
+                            if translation2 is not None:
+                                add_fragment(stroke_list, translation2)
+                    elif model == 2:
+                        if translation1 is not None:
+                            add_prefix(stroke_list, translation1)
+                        if translation2 is not None:
+                            add_fragment(stroke_list, translation2)
+                nb_rows += chunk_rows
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    sys.stderr.write('\r%u rows (%.0f rows/s)' % (
+                        nb_rows, nb_rows / elapsed if elapsed else 0))
+        if progress:
+            sys.stderr.write('\n')
     return combos_fragments, prefix_dictionary, suffix_dictionary
 
 
 def save_dictionary(dictionary, filename):
     utf_dict = OrderedDict(
-        (str(k).encode('utf-8'), str(v).encode('utf-8'))
+        (str(k), str(v))
         for k, v in sorted(dictionary.items())
     )
-    with open(filename, 'w') as fp:
+    with open(filename, 'w', encoding='utf-8') as fp:
         json.dump(utf_dict, fp,
                   indent=0,
                   sort_keys=False,
@@ -217,26 +257,29 @@ def save_dictionary(dictionary, filename):
 
 
 def run():
-    args = sys.argv[1:]
-    assert len(args) <= 1
-    if args:
-        database = args[0]
-    else:
-        database = 'voc-it.csv'
-    fragments, prefixes, suffixes = load_database(database)
+    parser = argparse.ArgumentParser(
+        description='Convert a Melani vocabulary database to Plover dictionaries.')
+    parser.add_argument('database', nargs='?', default='voc-it.csv',
+                        help='vocabulary database (default: %(default)s)')
+    add_jobs_argument(parser)
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report progress')
+    args = parser.parse_args()
+    fragments, prefixes, suffixes = load_database(args.database, jobs=args.jobs,
+                                                  progress=not args.quiet)
     for steno in set(prefixes.keys()) & set(suffixes.keys()):
         if prefixes[steno] == suffixes[steno]:
             del prefixes[steno]
     # Remove suffixes available through the orthographic dictionary.
-    theory = Theory(dict(fragments))
-    for steno, translation in suffixes.items():
-        if len(steno) != 1:
-            continue
-        try:
-            orthographic_translation = theory.translate_stroke(steno[0])
-        except KeyError:
-            continue
-        if orthographic_translation == translation:
+    theory = Theory({str(stroke): str(translation)
+                     for stroke, translation in fragments.items()})
+    single_strokes = [steno for steno in suffixes if len(steno) == 1]
+    orthographic_translations, __ = theory.translate_many(
+        steno[0] for steno in single_strokes
+    )
+    for steno, orthographic_translation in zip(single_strokes,
+                                               orthographic_translations):
+        if orthographic_translation == str(suffixes[steno]):
             del suffixes[steno]
     print('%u fragments' % len(fragments))
     # for stroke, translation in fragments.items():
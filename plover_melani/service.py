@@ -0,0 +1,212 @@
+''' Local lookup service, to avoid paying for a theory build in each tool.
+
+The server (see `melani_serve`) keeps a theory (and optionally some
+dictionaries) in memory, and answers requests over a Unix socket.
+
+The protocol is JSON lines, each request being an object with:
+
+- `op`: the operation, one of `translate` (single stroke steno to
+  translation), `strokes_to_text` (steno to text), `strokes_from_text`
+  (text to steno), or `lookup` (steno to dictionaries translation)
+- `args`: the batch of inputs (list of strings)
+- `id` (optional): copied as is into the response
+
+and each response an object with `results` (a list with the result for
+each input, `null` for failures), or `error`, and `id` if provided.
+Requests on a connection are answered in order.
+'''
+
+import asyncio
+import errno
+import json
+import os
+import socket
+import stat
+
+from plover.oslayer.config import CONFIG_DIR
+
+from plover_melani.steno import format_steno, parse_steno
+
+
+def default_socket_path():
+    return os.environ.get('PLOVER_MELANI_SOCKET',
+                          os.path.join(CONFIG_DIR, 'melani.sock'))
+
+
+def _remove_stale_socket(path):
+    ''' Remove the socket left at `path` by a dead server, raise
+    `OSError` if `path` is not a socket, or a server is listening.
+    '''
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, 'file exists, and is not a socket', path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        sock.close()
+    raise OSError(errno.EADDRINUSE, 'a server is already listening', path)
+
+
+class Server:
+
+    # Maximum size of a request line.
+    LINE_LIMIT = 16 * 1024 * 1024
+
+    # Inputs handled before yielding to other clients.
+    SLICE = 256
+
+    def __init__(self, theory, dictionaries=()):
+        self._theory = theory
+        self._dictionary = {}
+        # Note: the last dictionary has priority, like in Plover.
+        for dictionary in dictionaries:
+            for steno, translation in dictionary.items():
+                self._dictionary[format_steno(parse_steno(steno))] = translation
+        self._ops = {
+            'translate': self._translate,
+            'strokes_to_text': self._strokes_to_text,
+            'strokes_from_text': self._strokes_from_text,
+            'lookup': self._lookup,
+        }
+
+    def _translate(self, steno):
+        stroke_list = parse_steno(steno)
+        if len(stroke_list) != 1:
+            raise KeyError(steno)
+        return self._theory.translate_stroke(stroke_list[0])
+
+    def _strokes_to_text(self, steno):
+        return self._theory.strokes_to_text(parse_steno(steno))
+
+    def _strokes_from_text(self, text):
+        stroke_list = self._theory.strokes_from_text(text)
+        if not stroke_list:
+            return None
+        return format_steno(stroke_list)
+
+    def _lookup(self, steno):
+        return self._dictionary[format_steno(parse_steno(steno))]
+
+    async def handle(self, request):
+        ''' Return the response to `request` (a JSON object). '''
+        if not isinstance(request, dict):
+            return {'error': 'invalid request'}
+        response = {}
+        if 'id' in request:
+            response['id'] = request['id']
+        op = self._ops.get(request.get('op'))
+        args = request.get('args')
+        if op is None:
+            response['error'] = 'invalid operation: %r' % request.get('op')
+            return response
+        if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+            response['error'] = 'invalid arguments'
+            return response
+        results = []
+        for n, arg in enumerate(args):
+            if n and not n % self.SLICE:
+                # Don't hog the loop with big batches.
+                await asyncio.sleep(0)
+            try:
+                results.append(op(arg))
+            except (KeyError, ValueError):
+                results.append(None)
+        response['results'] = results
+        return response
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Request too big.
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    response = {'error': 'invalid JSON'}
+                else:
+                    response = await self.handle(request)
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path):
+        ''' Start listening on `path`, return the `asyncio` server. '''
+        _remove_stale_socket(path)
+        return await asyncio.start_unix_server(self._handle_client, path,
+                                               limit=self.LINE_LIMIT)
+
+    async def serve(self, path):
+        server = await self.start(path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class Client:
+    ''' Synchronous client, e.g.:
+
+        with Client() as client:
+            client.strokes_from_text(['spissimi', 'potto'])
+    '''
+
+    def __init__(self, path=None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(path or default_socket_path())
+        except OSError:
+            self._socket.close()
+            raise
+        self._file = self._socket.makefile('rwb')
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, op, args):
+        ''' Send a request, and return its results. '''
+        request = json.dumps({'op': op, 'args': list(args)}, ensure_ascii=False)
+        self._file.write(request.encode('utf-8') + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('connection closed by the server')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['results']
+
+    def translate(self, steno_list):
+        return self.request('translate', steno_list)
+
+    def strokes_to_text(self, steno_list):
+        return self.request('strokes_to_text', steno_list)
+
+    def strokes_from_text(self, text_list):
+        return self.request('strokes_from_text', text_list)
+
+    def lookup(self, steno_list):
+        return self.request('lookup', steno_list)
@@ -0,0 +1,130 @@
+''' Fast parsing and formatting of Melani steno, shared by the scripts.
+
+As all Melani keys are implicit hyphen keys, with distinct letters
+(uppercase for left keys and `E`/`O`, lowercase for right keys), a
+stroke can be parsed one letter at a time (in steno order). Other forms
+(e.g. numbers) are handled by `Stroke`.
+
+Parsed strokes and canonical steno strings are cached (and interned),
+as dictionaries and vocabularies repeat the same strokes many times.
+Note: a stroke parsed one letter at a time is already in canonical
+form, so the steno is cached for formatting too.
+'''
+
+import sys
+
+from plover_melani import system
+from plover_melani.theory import Stroke
+
+
+# Aliases used by the vocabulary database.
+ALIASES = (
+    ('\\', '/'),
+    ('$', '#'),
+)
+
+_KEYS_BITS = {key.strip('-'): 1 << n for n, key in enumerate(system.KEYS)}
+
+_NUMBER_KEY_MASK = _KEYS_BITS[system.NUMBER_KEY]
+
+
+# Lookup tables, to work on strokes 8 keys at a time.
+def _tables(fn):
+    return [
+        [
+            fn([shift + bit for bit in range(8) if byte & (1 << bit)])
+            for byte in range(1 << min(8, len(system.KEYS) - shift))
+        ]
+        for shift in range(0, len(system.KEYS), 8)
+    ]
+
+# Sort keys: the 1-based indexes of the stroke keys, as a byte string,
+# so strokes sort like `Stroke` objects do (keys sequences in
+# lexicographic order, shorter sequences first).
+_SORT_KEY_TABLES = _tables(lambda keys: bytes(n + 1 for n in keys))
+
+# Steno: without the number key, the concatenation of the keys letters.
+_STENO_TABLES = _tables(lambda keys: ''.join(system.KEYS[n].strip('-')
+                                             for n in keys))
+
+
+# Steno to `Stroke`.
+_strokes = {}
+# Integer bitmask to `Stroke`.
+_stroke_objects = {}
+# Integer bitmask to canonical steno.
+_stenos = {}
+
+
+def parse_stroke(steno):
+    ''' Parse a single stroke, and return it as a `Stroke`.
+
+    The same `Stroke` object is returned for equivalent steno.
+    Raise `ValueError` if `steno` is invalid.
+    '''
+    stroke = _strokes.get(steno)
+    if stroke is None:
+        steno = sys.intern(steno)
+        keys = 0
+        for char in steno:
+            key = _KEYS_BITS.get(char)
+            # Note: keys bits are in steno order, so a key
+            # out of order is not above the previous keys.
+            if key is None or key <= keys:
+                # Not a simple stroke (e.g. a number), or invalid.
+                keys = int(Stroke(steno))
+                break
+            keys |= key
+        else:
+            if not keys & _NUMBER_KEY_MASK:
+                _stenos.setdefault(keys, steno)
+        stroke = _stroke_objects.get(keys)
+        if stroke is None:
+            stroke = _stroke_objects[keys] = Stroke.from_integer(keys)
+        _strokes[steno] = stroke
+    return stroke
+
+
+def parse_steno(steno):
+    ''' Parse `steno` (aliases included), and return a tuple of `Stroke`. '''
+    for old, new in ALIASES:
+        if old in steno:
+            steno = steno.replace(old, new)
+    return tuple(map(parse_stroke, steno.split('/')))
+
+
+def sort_key(stroke):
+    ''' Return a key sorting like `Stroke` objects do, for `stroke`
+    (an integer bitmask or a `Stroke`).
+    '''
+    stroke = int(stroke)
+    key = b''
+    for table in _SORT_KEY_TABLES:
+        key += table[stroke & 0xff]
+        stroke >>= 8
+    return key
+
+
+def stroke_steno(stroke):
+    ''' Return the canonical steno for `stroke`
+    (an integer bitmask or a `Stroke`).
+    '''
+    # Note: don't use `stroke` as key, hashing `Stroke` objects is slow.
+    stroke = int(stroke)
+    steno = _stenos.get(stroke)
+    if steno is None:
+        keys = stroke
+        if keys & _NUMBER_KEY_MASK:
+            steno = str(Stroke.from_integer(keys))
+        else:
+            steno = ''
+            for table in _STENO_TABLES:
+                steno += table[keys & 0xff]
+                keys >>= 8
+        steno = _stenos[stroke] = sys.intern(steno)
+    return steno
+
+
+def format_steno(stroke_list):
+    ''' Return the canonical steno for `stroke_list`. '''
+    return '/'.join(map(stroke_steno, stroke_list))
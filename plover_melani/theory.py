@@ -1,12 +1,20 @@
+import bisect
+import collections
+import hashlib
+import heapq
 import json
 import os
-
-from pkg_resources import resource_stream
+import pickle
+import pkgutil
+import sys
+import tempfile
+import time
 
 from plover.oslayer.config import CONFIG_DIR
 from plover_stroke import BaseStroke
 
 from plover_melani import system
+from plover_melani.instrumentation import instrumented
 
 
 class Stroke(BaseStroke):
@@ -18,125 +26,794 @@ Stroke.setup(system.KEYS, system.IMPLICIT_HYPHEN_KEYS,
 
 META_ATTACH = '{^}'
 
+# Marks a key sequence that is not the prefix of any combo.
+_NOT_A_PREFIX = object()
+
+# Bump when changing the layout of the compiled theory.
+_CACHE_VERSION = 3
+
+
+def orthography_filename():
+    ''' Return the path to the user orthography (overriding the default one). '''
+    return os.path.join(CONFIG_DIR, 'melani_orthography.json')
+
+def read_orthography():
+    ''' Return the raw contents of the orthography in use. '''
+    filename = orthography_filename()
+    if os.path.exists(filename):
+        with open(filename, 'rb') as fp:
+            return fp.read()
+    return pkgutil.get_data('plover_melani', 'dictionaries/melani_orthography.json')
+
+
+class _Part:
+    ''' Translation of a combo (or stroke), without attach metas. '''
+
+    __slots__ = ('text', 'attach_left', 'attach_right')
+
+    def __init__(self, text, attach_left=False, attach_right=False):
+        self.text = text
+        self.attach_left = attach_left
+        self.attach_right = attach_right
+
+    @classmethod
+    def from_translation(cls, translation):
+        return cls(sys.intern(translation.replace(META_ATTACH, '')),
+                   translation.startswith(META_ATTACH),
+                   translation.endswith(META_ATTACH))
+
+
+class ReverseLookup:
+    ''' Resumable reverse lookup (text to strokes) of a growing text,
+    e.g. for as-you-type suggestions, see `Theory.reverse_lookup`.
+
+    Appending characters extends the previous search (instead of starting
+    over), so the cost of each update does not depend on the text length.
+    '''
+
+    def __init__(self, theory):
+        self._theory = theory
+        self.text = ''
+        # For each position in the text: the best reachable `stroke`
+        # (stroke being built up to that position), as a mapping of
+        # `stroke` to `(cost, parent)`, with `parent` None (start), or
+        # `(parent_position, parent_stroke, new_stroke)`.
+        self._states = [{0: (0, None)}]
+        # Word parts matches in progress: `(start_position, trie_node)`.
+        self._matches = [(0, theory._word_parts_trie)]
+
+    def _step(self, char):
+        # Return the states and matches after appending `char`.
+        theory = self._theory
+        stroke_text = theory._stroke_text
+        position = len(self._states)
+        states = {}
+        matches = []
+        # Note: in order of start position, so longest parts first,
+        # like `strokes_from_text`.
+        for start, node in self._matches:
+            node = node.get(char)
+            if node is None:
+                continue
+            matches.append((start, node))
+            combo_list = node.get('')
+            if combo_list is None:
+                continue
+            for stroke, (cost, __) in self._states[start].items():
+                for combo in combo_list:
+                    # First try to extend current stroke.
+                    if stroke and stroke < (combo & -combo):
+                        extended_stroke = stroke | combo
+                        best = states.get(extended_stroke)
+                        if (
+                            (best is None or best[0] > cost) and
+                            stroke_text(extended_stroke) ==
+                            stroke_text(stroke) + stroke_text(combo)
+                        ):
+                            states[extended_stroke] = (cost, (start, stroke, False))
+                    # Start a new stroke.
+                    best = states.get(combo)
+                    if best is None or best[0] > cost + 1:
+                        states[combo] = (cost + 1, (start, stroke, True))
+        if states:
+            matches.append((position, theory._word_parts_trie))
+        return states, matches
+
+    def append(self, chars):
+        ''' Append `chars` to the text. '''
+        for char in chars:
+            states, self._matches = self._step(char)
+            self._states.append(states)
+            self.text += char
+
+    def strokes(self):
+        ''' Return the strokes for the current text.
+
+        Like `strokes_from_text`, an outline with the least number of
+        strokes (though not necessarily the same one, in case of ties).
+        '''
+        if not self.text:
+            return []
+        if self.text[-1] in 'ieao':
+            states, __ = self._step(' ')
+        else:
+            states = self._states[-1]
+        if not states:
+            return ()
+        stroke = min(states, key=lambda stroke: states[stroke][0])
+        stroke_list = [Stroke.from_integer(stroke)]
+        parent = states[stroke][1]
+        while parent is not None:
+            position, stroke, new_stroke = parent
+            if new_stroke and stroke:
+                stroke_list.append(Stroke.from_integer(stroke))
+            parent = self._states[position][stroke][1]
+        stroke_list.reverse()
+        return stroke_list
+
+
+def _sort_combos(combo_list):
+    # We want left combos to be given priority over right ones,
+    # e.g. 'R-' over '-R' for 'r', so sort in steno order.
+    if len(combo_list) == 1:
+        return tuple(combo_list)
+    return tuple(sorted(combo_list, key=Stroke.from_integer))
+
+
+def _copy_trie(node):
+    # Copy the trie nodes, sharing the (immutable) combos lists.
+    return {
+        char: value if char == '' else _copy_trie(value)
+        for char, value in node.items()
+    }
+
 
 class Theory:
 
+    # Note: for compactness, combos are stored as integer bitmasks
+    # (not `Stroke` objects), strings are interned, and combos lists
+    # are tuples (shared between `_word_parts` and `_word_parts_trie`).
+
     def __init__(self, fragments=None):
         self._combos = {}
         self._max_combos_len = 0
+        # Number of combos per length, to keep `_max_combos_len` up to date.
+        self._combos_lens = collections.Counter()
+        self._combo_prefixes = {}
         self._word_parts = {}
         self._max_word_part_len = 0
+        # Number of word parts per length, same for `_max_word_part_len`.
+        self._word_parts_lens = collections.Counter()
+        self._word_parts_trie = {}
+        self._stroke_texts = {}
+        # Number of combos using / starting with / ending with each key,
+        # to keep the prefilter masks up to date, see `_update_prefilter`.
+        self._keys_counts = collections.Counter()
+        self._first_keys_counts = collections.Counter()
+        self._last_keys_counts = collections.Counter()
+        # Number of strokes rejected by the prefilter.
+        self.prefilter_rejections = 0
+        # SHA-1 of the orthography contents the theory was built from
+        # (`None` when built from `fragments`). Note: not updated when
+        # the theory is modified.
+        self.orthography_digest = None
         if fragments is None:
-            fragments_filename = os.path.join(CONFIG_DIR, 'melani_orthography.json')
-            if os.path.exists(fragments_filename):
-                with open(fragments_filename, 'rb') as fp:
-                    fragments = json.loads(fp.read().decode('utf-8'))
-            else:
-                with resource_stream('plover_melani', 'dictionaries/melani_orthography.json') as fp:
-                    fragments = json.loads(fp.read().decode('utf-8'))
+            data = read_orthography()
+            cache_filename = os.path.join(CONFIG_DIR, 'melani_orthography.cache')
+            digest = self.orthography_digest = hashlib.sha1(data).hexdigest()
+            if not self._load_cache(cache_filename, digest):
+                self._build(json.loads(data.decode('utf-8')))
+                self._save_cache(cache_filename, digest)
+        else:
+            self._build(fragments)
+        self._update_prefilter(self._combos, 1)
+
+    def _build(self, fragments):
         for steno, translation in fragments.items():
             stroke = Stroke.from_steno(steno)
-            assert stroke not in self._combos
-            self._combos[stroke] = translation
-            self._max_combos_len = max(len(combo) for combo in self._combos) if self._combos else 0
-        for combo, part in self._combos.items():
-            if part.endswith(META_ATTACH):
-                part = part[:-3]
-            else:
-                part = part + ' '
-            if part in self._word_parts:
-                self._word_parts[part] += (combo,)
-            else:
-                self._word_parts[part] = (combo,)
-        for part, combo_list in self._word_parts.items():
-            # We want left combos to be given priority over right ones,
-            # e.g. 'R-' over '-R' for 'r'.
-            self._word_parts[part] = sorted(combo_list)
-        if self._word_parts:
-            self._max_word_part_len = max(len(part) for part in self._word_parts)
+            combo = int(stroke)
+            assert combo not in self._combos
+            self._combos[combo] = sys.intern(translation)
+            self._combos_lens[len(stroke)] += 1
+        self._max_combos_len = max(self._combos_lens, default=0)
+        # Compile the combos into a trie over the keys (in steno order):
+        # each key-order prefix of a combo (as an integer bitmask) maps
+        # to that combo translation (as a `_Part`), or to `None` if the
+        # prefix is not itself a valid combo.
+        for combo, translation in self._combos.items():
+            keys = combo
+            prefix = 0
+            while keys:
+                key = keys & -keys
+                keys ^= key
+                prefix |= key
+                self._combo_prefixes.setdefault(prefix, None)
+            self._combo_prefixes[prefix] = _Part.from_translation(translation)
+        word_parts = {}
+        for combo, translation in self._combos.items():
+            part = self._word_part(translation)
+            word_parts.setdefault(part, []).append(combo)
+        for part, combo_list in word_parts.items():
+            combo_list = self._word_parts[part] = _sort_combos(combo_list)
+            self._word_parts_lens[len(part)] += 1
+            # Index word parts in a character trie, the combos
+            # for a complete part being stored under the '' key.
+            node = self._word_parts_trie
+            for char in part:
+                node = node.setdefault(char, {})
+            node[''] = combo_list
+        self._max_word_part_len = max(self._word_parts_lens, default=0)
+
+    def _update_prefilter(self, combos, delta):
+        # A translatable stroke is a sequence of combos, so it only uses
+        # keys part of a combo, and starts (ends) with a key starting
+        # (ending) a combo: this allows rejecting most untranslatable
+        # strokes with a few integer operations.
+        for combo in combos:
+            keys = int(combo)
+            self._first_keys_counts[keys & -keys] += delta
+            self._last_keys_counts[1 << (keys.bit_length() - 1)] += delta
+            while keys:
+                key = keys & -keys
+                keys ^= key
+                self._keys_counts[key] += delta
+        def mask(counts):
+            return sum(key for key, count in counts.items() if count)
+        self._rejected_keys = ((1 << len(system.KEYS)) - 1) & ~mask(self._keys_counts)
+        self._first_keys = mask(self._first_keys_counts)
+        self._last_keys = mask(self._last_keys_counts)
+
+    @staticmethod
+    def _word_part(translation):
+        if translation.endswith(META_ATTACH):
+            return sys.intern(translation[:-3])
+        return sys.intern(translation + ' ')
+
+    def memory_report(self):
+        ''' Return the (approximate) memory footprint in bytes of each
+        internal table, and their `total`.
+
+        Objects shared between tables are only accounted for once
+        (in the first one).
+        '''
+        seen = set()
+        def sizeof(obj):
+            size = 0
+            stack = [obj]
+            while stack:
+                obj = stack.pop()
+                if id(obj) in seen:
+                    continue
+                seen.add(id(obj))
+                size += sys.getsizeof(obj)
+                if isinstance(obj, dict):
+                    stack.extend(obj.keys())
+                    stack.extend(obj.values())
+                elif isinstance(obj, (list, tuple)):
+                    stack.extend(obj)
+                elif isinstance(obj, _Part):
+                    stack.append(obj.text)
+            return size
+        report = {
+            name: sizeof(getattr(self, '_' + name))
+            for name in (
+                'combos',
+                'combos_lens',
+                'combo_prefixes',
+                'word_parts',
+                'word_parts_lens',
+                'word_parts_trie',
+                'stroke_texts',
+                'keys_counts',
+                'first_keys_counts',
+                'last_keys_counts',
+            )
+        }
+        report['total'] = sum(report.values())
+        return report
+
+    # Incremental updates. {{{
+
+    def copy(self):
+        ''' Return an independent copy of the theory.
+
+        Safe to use while other threads are doing lookups with the
+        theory: only the tables lookups never modify are copied, the
+        memoized stroke texts and statistics start afresh.
+        '''
+        theory = Theory({})
+        theory._combos = dict(self._combos)
+        theory._max_combos_len = self._max_combos_len
+        theory._combos_lens = collections.Counter(self._combos_lens)
+        # Note: `_Part` objects and combos lists are never modified in place.
+        theory._combo_prefixes = dict(self._combo_prefixes)
+        theory._word_parts = dict(self._word_parts)
+        theory._max_word_part_len = self._max_word_part_len
+        theory._word_parts_lens = collections.Counter(self._word_parts_lens)
+        theory._word_parts_trie = _copy_trie(self._word_parts_trie)
+        theory._keys_counts = collections.Counter(self._keys_counts)
+        theory._first_keys_counts = collections.Counter(self._first_keys_counts)
+        theory._last_keys_counts = collections.Counter(self._last_keys_counts)
+        theory._rejected_keys = self._rejected_keys
+        theory._first_keys = self._first_keys
+        theory._last_keys = self._last_keys
+        theory.orthography_digest = self.orthography_digest
+        return theory
+
+    def add_fragment(self, steno, translation):
+        ''' Add (or replace) the combo for `steno`. '''
+        stroke = Stroke(steno)
+        combo = int(stroke)
+        if combo in self._combos:
+            self.remove_fragment(stroke)
+        self._combos[combo] = sys.intern(translation)
+        self._combos_lens[len(stroke)] += 1
+        self._max_combos_len = max(self._max_combos_len, len(stroke))
+        keys = combo
+        prefix = 0
+        while keys:
+            key = keys & -keys
+            keys ^= key
+            prefix |= key
+            self._combo_prefixes.setdefault(prefix, None)
+        self._combo_prefixes[prefix] = _Part.from_translation(translation)
+        part = self._word_part(translation)
+        combo_list = self._word_parts.get(part)
+        if combo_list is None:
+            combo_list = ()
+            self._word_parts_lens[len(part)] += 1
+            self._max_word_part_len = max(self._max_word_part_len, len(part))
+        combo_list = self._word_parts[part] = _sort_combos(combo_list + (combo,))
+        node = self._word_parts_trie
+        for char in part:
+            node = node.setdefault(char, {})
+        node[''] = combo_list
+        self._stroke_texts = {}
+        self._update_prefilter((combo,), 1)
+
+    def remove_fragment(self, steno):
+        ''' Remove the combo for `steno`. '''
+        stroke = Stroke(steno)
+        combo = int(stroke)
+        translation = self._combos.pop(combo)
+        # Prune the keys trie: remove prefixes that are
+        # neither a combo, nor lead to one anymore.
+        prefix = combo
+        self._combo_prefixes[prefix] = None
+        while prefix:
+            if self._combo_prefixes[prefix] is not None:
+                break
+            if any(prefix | (1 << n) in self._combo_prefixes
+                   for n in range(prefix.bit_length(), len(system.KEYS))):
+                break
+            del self._combo_prefixes[prefix]
+            prefix &= ~(1 << (prefix.bit_length() - 1))
+        self._combos_lens[len(stroke)] -= 1
+        if not self._combos_lens[len(stroke)]:
+            del self._combos_lens[len(stroke)]
+            self._max_combos_len = max(self._combos_lens, default=0)
+        part = self._word_part(translation)
+        combo_list = tuple(c for c in self._word_parts[part] if c != combo)
+        path = [self._word_parts_trie]
+        for char in part:
+            path.append(path[-1][char])
+        if combo_list:
+            self._word_parts[part] = path[-1][''] = combo_list
         else:
-            self._max_word_part_len = 0
+            del self._word_parts[part]
+            del path[-1]['']
+            # Prune now empty nodes.
+            for depth in range(len(part), 0, -1):
+                if path[depth]:
+                    break
+                del path[depth - 1][part[depth - 1]]
+            self._word_parts_lens[len(part)] -= 1
+            if not self._word_parts_lens[len(part)]:
+                del self._word_parts_lens[len(part)]
+                self._max_word_part_len = max(self._word_parts_lens, default=0)
+        self._stroke_texts = {}
+        self._update_prefilter((combo,), -1)
 
-    def translate_stroke(self, stroke):
+    def update(self, fragments):
+        ''' Update the theory to match `fragments`, only changing the
+        necessary combos. Return the number of changes.
+        '''
+        combos = {
+            int(Stroke.from_steno(steno)): translation
+            for steno, translation in fragments.items()
+        }
+        changes = 0
+        for combo in [c for c in self._combos if c not in combos]:
+            self.remove_fragment(combo)
+            changes += 1
+        for combo, translation in combos.items():
+            if self._combos.get(combo) != translation:
+                self.add_fragment(combo, translation)
+                changes += 1
+        return changes
+
+    # }}}
+
+    # Compiled theory cache. {{{
+
+    def _load_cache(self, filename, digest):
+        try:
+            with open(filename, 'rb') as fp:
+                version, cache_digest, state = pickle.load(fp)
+        except Exception:
+            return False
+        if version != _CACHE_VERSION or cache_digest != digest:
+            return False
+        self._combos = state['combos']
+        self._max_combos_len = state['max_combos_len']
+        self._combos_lens = state['combos_lens']
+        self._combo_prefixes = state['combo_prefixes']
+        self._word_parts = state['word_parts']
+        self._max_word_part_len = state['max_word_part_len']
+        self._word_parts_lens = state['word_parts_lens']
+        self._word_parts_trie = state['word_parts_trie']
+        return True
+
+    def _save_cache(self, filename, digest):
+        state = {
+            'combos': self._combos,
+            'max_combos_len': self._max_combos_len,
+            'combos_lens': self._combos_lens,
+            'combo_prefixes': self._combo_prefixes,
+            'word_parts': self._word_parts,
+            'max_word_part_len': self._max_word_part_len,
+            'word_parts_lens': self._word_parts_lens,
+            'word_parts_trie': self._word_parts_trie,
+        }
+        # Note: use a unique temporary file, as several processes
+        # (e.g. the scripts workers) may be saving the cache at once.
+        try:
+            fd, tmp_filename = tempfile.mkstemp(
+                prefix=os.path.basename(filename) + '.',
+                suffix='.tmp', dir=os.path.dirname(filename))
+        except OSError:
+            # The cache is only an optimization.
+            return
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump((_CACHE_VERSION, digest, state), fp,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+
+    # }}}
+
+    def _translate_stroke(self, stroke):
         if not self._combos:
             raise KeyError
-        keys = list(stroke.keys())
-        text = ''
+        combo_prefixes = self._combo_prefixes
+        keys = int(stroke)
+        if keys and (keys & self._rejected_keys or
+                     not keys & -keys & self._first_keys or
+                     not 1 << (keys.bit_length() - 1) & self._last_keys):
+            self.prefilter_rejections += 1
+            raise KeyError
+        part_list = []
         while keys:
-            combo = Stroke(keys[0:self._max_combos_len])
-            while combo:
-                if combo in self._combos:
-                    part = self._combos[combo]
-                    text += part
+            # Walk the trie for the longest combo matching the next keys.
+            combo = prefix = 0
+            leftover_keys = keys
+            while leftover_keys:
+                key = leftover_keys & -leftover_keys
+                leftover_keys ^= key
+                prefix |= key
+                part = combo_prefixes.get(prefix, _NOT_A_PREFIX)
+                if part is _NOT_A_PREFIX:
                     break
-                combo -= combo.last()
+                if part is not None:
+                    combo, combo_part = prefix, part
             if not combo:
                 raise KeyError
-            keys = keys[len(combo):]
-        attach_start = text.startswith(META_ATTACH)
-        attach_end = text.endswith(META_ATTACH)
-        text = text.replace(META_ATTACH, '')
-        if attach_start:
+            part_list.append(combo_part)
+            keys ^= combo
+        if len(part_list) == 1:
+            return part_list[0]
+        if not part_list:
+            return _Part('')
+        return _Part(''.join(part.text for part in part_list),
+                     part_list[0].attach_left,
+                     part_list[-1].attach_right)
+
+    @instrumented('theory.translate_stroke')
+    def translate_stroke(self, stroke):
+        part = self._translate_stroke(stroke)
+        text = part.text
+        if part.attach_left:
             text = META_ATTACH + text
-        if attach_end:
+        if part.attach_right:
             text = text + META_ATTACH
         return text
 
+    def translate_many(self, strokes):
+        ''' Translate a batch of strokes (or integer stroke bitmasks).
+
+        This is `translate_stroke` in a loop, but memoized: each distinct
+        stroke is only translated once, which helps with inputs repeating
+        the same strokes (e.g. dictionaries).
+
+        Return a list of translations (`None` for strokes without one) and
+        a miss mask (a `bytearray`, 1 for each untranslatable stroke).
+        '''
+        if hasattr(strokes, 'tolist'):
+            # Iterating over a list is faster.
+            strokes = strokes.tolist()
+        translate = self.translate_stroke
+        memo = {}
+        translations = []
+        misses = bytearray()
+        for stroke in strokes:
+            stroke = int(stroke)
+            if stroke in memo:
+                translation = memo[stroke]
+            else:
+                try:
+                    translation = translate(stroke)
+                except KeyError:
+                    translation = None
+                memo[stroke] = translation
+            translations.append(translation)
+            misses.append(translation is None)
+        return translations, misses
+
+    def iter_translations(self):
+        ''' Enumerate every stroke with a translation.
+
+        Yield `(stroke, translation)` tuples, with `stroke` an integer
+        bitmask, in no particular order.
+        '''
+        combo_prefixes = self._combo_prefixes
+        # Translatable strokes are sequences of combos, each one starting
+        # after the last key of the previous one, so index combos by their
+        # first key: the candidates following a combo are then a suffix of
+        # the list.
+        combos = []
+        for combo, part in combo_prefixes.items():
+            if part is None:
+                continue
+            keys = []
+            leftover_keys = combo
+            while leftover_keys:
+                key = leftover_keys & -leftover_keys
+                leftover_keys ^= key
+                keys.append(key)
+            combos.append((keys[0], combo, keys, part))
+        combos.sort(key=lambda entry: entry[0])
+        first_keys = [entry[0] for entry in combos]
+        # Depth-first search, stack entries: (stroke, last_key, walks,
+        # text, first_part), with `walks` the trie walks started at each
+        # combo of the stroke that could still match a longer combo: as
+        # `translate_stroke` is greedy, a sequence is only valid if none
+        # of those walks reaches a combo when continued with the keys
+        # of the next combo (the same stroke would otherwise decompose
+        # differently), which prunes whole subtrees of the search.
+        stack = [(0, 0, (), '', None)]
+        while stack:
+            stroke, last_key, walks, text, first_part = stack.pop()
+            for __, combo, keys, part in combos[bisect.bisect_right(first_keys, last_key):]:
+                next_walks = []
+                for prefix in walks:
+                    for key in keys:
+                        prefix |= key
+                        prefix_part = combo_prefixes.get(prefix, _NOT_A_PREFIX)
+                        if prefix_part is _NOT_A_PREFIX:
+                            break
+                        if prefix_part is not None:
+                            break
+                    else:
+                        next_walks.append(prefix)
+                        continue
+                    if prefix_part is not _NOT_A_PREFIX:
+                        break
+                else:
+                    next_walks.append(combo)
+                    next_part = first_part or part
+                    next_text = text + part.text
+                    translation = next_text
+                    if next_part.attach_left:
+                        translation = META_ATTACH + translation
+                    if part.attach_right:
+                        translation += META_ATTACH
+                    yield stroke | combo, translation
+                    stack.append((stroke | combo, keys[-1], tuple(next_walks),
+                                  next_text, next_part))
+
+    @instrumented('theory.strokes_to_text')
     def strokes_to_text(self, stroke_list):
-        text = ''
+        text_list = []
         attach_next = True
         for s in stroke_list:
-            part = self.translate_stroke(s)
-            if not attach_next and not part.startswith(META_ATTACH):
-                text += ' '
-            attach_next = part.endswith(META_ATTACH)
-            text += part.replace(META_ATTACH, '')
+            part = self._translate_stroke(s)
+            if not attach_next and not part.attach_left:
+                text_list.append(' ')
+            attach_next = part.attach_right
+            text_list.append(part.text)
         if not attach_next:
-            text += ' '
-        return text
+            text_list.append(' ')
+        return ''.join(text_list)
+
+    def _stroke_text(self, stroke):
+        # Memoized text of a single stroke ('' if untranslatable).
+        part = self._stroke_texts.get(stroke)
+        if part is None:
+            try:
+                part = self.strokes_to_text((stroke,))
+            except KeyError:
+                part = ''
+            self._stroke_texts[stroke] = part
+        return part
+
+    def _word_parts_at(self, text, position):
+        # Return the `(next_position, combo_list)` of the word parts
+        # matching `text` at `position`, longest part first.
+        node = self._word_parts_trie
+        candidates = []
+        for index in range(position, len(text)):
+            node = node.get(text[index])
+            if node is None:
+                break
+            combo_list = node.get('')
+            if combo_list is not None:
+                candidates.append((index + 1, combo_list))
+        candidates.reverse()
+        return candidates
 
+    @instrumented('theory.strokes_from_text', track_slowest=True)
     def strokes_from_text(self, text):
         if not text:
             return []
         if text[-1] in 'ieao':
             text = text + ' '
-        leftover_text = text
-        stroke_list = []
-        part_list = []
-        while len(leftover_text) > 0:
-            # Find candidate parts.
-            combo_list = []
-            part = leftover_text[0:self._max_word_part_len]
-            while len(part) > 0:
-                combo_list.extend(self._word_parts.get(part, ()))
-                part = part[:-1]
-            if len(combo_list) == 0:
-                return ()
-            # First try to extend current stroke.
-            part = None
-            if stroke_list:
-                stroke = stroke_list[-1]
+        end = len(text)
+        # Find the decomposition using the least number of strokes:
+        # shortest path search over `(position, stroke)` states, with
+        # `stroke` the stroke being built up to `position` in the text.
+        # Starting a new stroke costs 1, extending the current one with
+        # a combo (as long as its translation does not change) is free.
+        stroke_text = self._stroke_text
+        # Queue entries: (cost, order, position, stroke, parent, new_stroke),
+        # with `order` used for tie-breaking: favor candidates in the order
+        # they are generated (longest part first, left combos first).
+        queue = [(0, 0, 0, 0, None, False)]
+        order = 0
+        visited = {}
+        # Word parts matching at each position (many states share one).
+        word_parts = {}
+        while queue:
+            cost, __, position, stroke, parent, new_stroke = heapq.heappop(queue)
+            state = (position, stroke)
+            if state in visited:
+                continue
+            visited[state] = (parent, new_stroke)
+            if position == end:
+                break
+            candidates = word_parts.get(position)
+            if candidates is None:
+                candidates = word_parts[position] = self._word_parts_at(text, position)
+            for next_position, combo_list in candidates:
                 for combo in combo_list:
-                    if stroke.is_prefix(combo):
+                    # First try to extend current stroke.
+                    if stroke and stroke < (combo & -combo):
+                        extended_stroke = stroke | combo
                         # Check if we're not changing the translation.
-                        combo_part = self.strokes_to_text((combo,))
-                        wanted = self.strokes_to_text((stroke,)) + combo_part
-                        result = self.strokes_to_text((stroke + combo,))
-                        if wanted != result:
-                            continue
-                        part = combo_part
-                        stroke_list[-1] += combo
-                        part_list[-1] += part
-                        break
-            # Start a new stroke
-            if part is None:
-                combo = combo_list[0]
-                part = self.strokes_to_text((combo,))
-                stroke_list.append(combo)
-                part_list.append(part)
-            assert len(part) > 0
-            leftover_text = leftover_text[len(part):]
-        assert len(stroke_list) == len(part_list)
+                        if (
+                            (next_position, extended_stroke) not in visited and
+                            stroke_text(extended_stroke) ==
+                            stroke_text(stroke) + stroke_text(combo)
+                        ):
+                            order += 1
+                            heapq.heappush(queue, (cost, order, next_position,
+                                                   extended_stroke, state, False))
+                    # Start a new stroke.
+                    if (next_position, combo) not in visited:
+                        order += 1
+                        heapq.heappush(queue, (cost + 1, order, next_position,
+                                               combo, state, True))
+        else:
+            return ()
+        stroke_list = [Stroke.from_integer(stroke)]
+        parent, new_stroke = visited[state]
+        while parent is not None:
+            if new_stroke and parent[1]:
+                stroke_list.append(Stroke.from_integer(parent[1]))
+            parent, new_stroke = visited[parent]
+        stroke_list.reverse()
         return stroke_list
 
+    def reverse_lookup(self, text=''):
+        ''' Start a resumable reverse lookup of `text`, see `ReverseLookup`. '''
+        lookup = ReverseLookup(self)
+        lookup.append(text)
+        return lookup
+
+    def outlines_from_text(self, text, count=5, max_expansions=10000, timeout=0.05):
+        ''' Return up to `count` distinct outlines (lists of strokes) for
+        `text`, ranked by number of strokes, then number of keys.
+
+        See `search_outlines`.
+        '''
+        return self.search_outlines(text, count, max_expansions, timeout)[0]
+
+    @instrumented('theory.search_outlines', track_slowest=True,
+                  input=lambda self, text, *args, **kwargs: text,
+                  miss=lambda result: not result[0])
+    def search_outlines(self, text, count=5, max_expansions=10000, timeout=0.05):
+        ''' Return `(outlines, complete)`: up to `count` distinct outlines
+        (lists of strokes) for `text`, ranked by number of strokes, then
+        number of keys, and whether the search completed.
+
+        The search is bounded: it stops after `max_expansions` expanded
+        states, or `timeout` seconds, returning the outlines found so far
+        (or if none was found yet, the outline from `strokes_from_text`),
+        and `complete` is false.
+        '''
+        if not text:
+            return [], True
+        if text[-1] in 'ieao':
+            text = text + ' '
+        end = len(text)
+        stroke_text = self._stroke_text
+        deadline = time.perf_counter() + timeout
+        # Same search as `strokes_from_text`, but over partial outlines
+        # (so the same state can be reached through different paths),
+        # with each state only expanded up to `count` times. Costs only
+        # increase along a path, so complete outlines are found in order.
+        # Queue entries: (nb_strokes, nb_keys, order, position, stroke, outline),
+        # with `outline` the tuple of previous strokes.
+        queue = [(0, 0, 0, 0, 0, ())]
+        order = 0
+        expansions = collections.Counter()
+        outlines = []
+        complete = True
+        while queue and len(outlines) < count:
+            if max_expansions <= 0 or time.perf_counter() >= deadline:
+                complete = False
+                break
+            nb_strokes, nb_keys, __, position, stroke, outline = heapq.heappop(queue)
+            if position == end:
+                outline = [Stroke.from_integer(s) for s in outline + (stroke,)]
+                # Check the outline round-trips.
+                if outline not in outlines and self.strokes_to_text(outline) == text:
+                    outlines.append(outline)
+                continue
+            state = (position, stroke)
+            if expansions[state] >= count:
+                continue
+            expansions[state] += 1
+            max_expansions -= 1
+            for next_position, combo_list in self._word_parts_at(text, position):
+                for combo in combo_list:
+                    combo_keys = bin(combo).count('1')
+                    # First try to extend current stroke.
+                    if stroke and stroke < (combo & -combo):
+                        extended_stroke = stroke | combo
+                        if (
+                            stroke_text(extended_stroke) ==
+                            stroke_text(stroke) + stroke_text(combo)
+                        ):
+                            order += 1
+                            heapq.heappush(queue, (nb_strokes, nb_keys + combo_keys,
+                                                   order, next_position,
+                                                   extended_stroke, outline))
+                    # Start a new stroke.
+                    order += 1
+                    heapq.heappush(queue, (nb_strokes + 1, nb_keys + combo_keys,
+                                           order, next_position, combo,
+                                           outline + (stroke,) if stroke else outline))
+        if not complete and not outlines:
+            # Don't come back empty handed when the search
+            # is cut short, e.g. on long texts.
+            stroke_list = self.strokes_from_text(text)
+            if stroke_list:
+                outlines.append(list(stroke_list))
+        return outlines, complete
+
 # vim: foldmethod=marker
@@ -0,0 +1,18 @@
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def config_dir(tmp_path_factory):
+    ''' Don't use (or write to) the user's Plover configuration. '''
+    path = str(tmp_path_factory.mktemp('config'))
+    patchers = [
+        mock.patch('plover_melani.%s.CONFIG_DIR' % module, path)
+        for module in ('theory', 'reverse_cache', 'service')
+    ]
+    for patcher in patchers:
+        patcher.start()
+    yield path
+    for patcher in patchers:
+        patcher.stop()
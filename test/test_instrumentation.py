@@ -0,0 +1,75 @@
+import importlib
+
+import pytest
+
+from plover_melani import instrumentation
+
+
+@pytest.fixture
+def enabled_instrumentation(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'ENABLED', True)
+    monkeypatch.setattr(instrumentation, '_stats', {})
+    return instrumentation
+
+
+def lookup(key, suffix=''):
+    if key == 'miss':
+        raise KeyError
+    return key.upper() + suffix
+
+
+@pytest.mark.parametrize('value, enabled', (
+    (None, False),
+    ('', False),
+    ('0', False),
+    ('1', True),
+))
+def test_environment(monkeypatch, value, enabled):
+    if value is None:
+        monkeypatch.delenv('PLOVER_MELANI_STATS', raising=False)
+    else:
+        monkeypatch.setenv('PLOVER_MELANI_STATS', value)
+    try:
+        assert importlib.reload(instrumentation).ENABLED == enabled
+    finally:
+        monkeypatch.undo()
+        importlib.reload(instrumentation)
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'ENABLED', False)
+    monkeypatch.setattr(instrumentation, '_stats', {})
+    assert instrumentation.instrumented('lookup')(lookup) is lookup
+    assert instrumentation.stats() == {}
+
+
+def test_enabled(enabled_instrumentation):
+    instrumented_lookup = enabled_instrumentation.instrumented(
+        'lookup', track_slowest=True)(lookup)
+    assert instrumented_lookup.__name__ == 'lookup'
+    assert instrumented_lookup('a') == 'A'
+    assert instrumented_lookup('a', suffix='!') == 'A!'
+    with pytest.raises(KeyError):
+        instrumented_lookup('miss')
+    assert instrumented_lookup('') == ''
+    stats = enabled_instrumentation.stats()['lookup']
+    assert stats['calls'] == 4
+    assert stats['misses'] == 2
+    assert sum(stats['histogram'].values()) == 4
+    assert 0 < stats['max_us'] <= stats['total_ms'] * 1000
+    assert sorted(s['input'] for s in stats['slowest']) == \
+            ["''", "'a'", "'a'", "'miss'"]
+
+
+def test_selectors(enabled_instrumentation):
+    instrumented_lookup = enabled_instrumentation.instrumented(
+        'lookup', track_slowest=True,
+        input=lambda key, suffix='': key + suffix,
+        miss=lambda result: result.endswith('?'),
+    )(lookup)
+    assert instrumented_lookup('a', suffix='?') == 'A?'
+    assert instrumented_lookup('', '!') == '!'
+    stats = enabled_instrumentation.stats()['lookup']
+    assert stats['calls'] == 2
+    assert stats['misses'] == 1
+    assert sorted(s['input'] for s in stats['slowest']) == ["'!'", "'a?'"]
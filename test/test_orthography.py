@@ -0,0 +1,190 @@
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+import plover_melani
+from plover_melani.theory import read_orthography
+
+
+ORTHOGRAPHY_PY = os.path.join(os.path.dirname(plover_melani.__file__),
+                              'dictionaries', 'melani_orthography.py')
+
+
+def load_orthography():
+    spec = importlib.util.spec_from_file_location('melani_orthography', ORTHOGRAPHY_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def orthography():
+    return load_orthography()
+
+
+def test_lazy_theory(orthography):
+    assert orthography.theory is None
+    assert orthography.reverse_lookup('spissimi')[0] == ('SPsi',)
+    assert orthography.theory is not None
+
+
+def test_lookup(orthography):
+    assert orthography.lookup(('SPsi',)) == 'spissimi'
+    assert orthography.lookup(('PT',)) == 'pot{^}'
+    with pytest.raises(KeyError):
+        orthography.lookup(('#',))
+    with pytest.raises(KeyError):
+        orthography.lookup(('invalid',))
+    assert orthography.stats()['prefilter_rejections'] == 1
+
+
+def test_multi_strokes_lookup(monkeypatch):
+    monkeypatch.setenv('PLOVER_MELANI_LONGEST_KEY', '3')
+    orthography = load_orthography()
+    assert orthography.LONGEST_KEY == 3
+    assert orthography.lookup(('CIr',)) == 'cir{^}'
+    assert orthography.lookup(('CIr', 'CO')) == 'circo{^}'
+    assert orthography.lookup(('CIr', 'CO', 'SCVRAho')) == 'circoscrivano'
+    assert orthography.lookup(('PT', 'To')) == 'potto'
+    # Outlines must form a single word.
+    for key in (
+        ('SPsi', 'PT'),
+        ('SPsi', 'PT', 'To'),
+        ('CIr', '#'),
+        ('CIr', '#', 'CO'),
+    ):
+        with pytest.raises(KeyError):
+            orthography.lookup(key)
+    # Rejected prefixes are cached.
+    info = orthography.stats()['outline_cache']
+    assert (info['hits'], info['misses']) == (3, 7)
+
+
+def test_reverse_lookup(orthography, monkeypatch):
+    monkeypatch.setattr(orthography, 'REVERSE_LOOKUP_COUNT', 3)
+    outlines = orthography.reverse_lookup('potto')
+    assert outlines == [('PTto',), ('PTt', 'o'), ('PT', 'To')]
+    assert orthography.reverse_lookup('potto') == outlines
+    assert orthography.stats()['reverse_lookup_cache']['hits'] == 1
+    assert orthography.reverse_lookup('xyzq') == []
+
+
+def test_reverse_lookup_long_text(orthography):
+    # The search is cut short, but still returns an outline.
+    text = ' '.join(['la casa bella sovrappopolazione'] * 20)
+    outlines = orthography.reverse_lookup(text)
+    assert len(outlines) == 1
+    theory = orthography.get_theory()
+    assert outlines[0] == tuple(str(s) for s in theory.strokes_from_text(text))
+    # And incomplete results are not memoized.
+    orthography.reverse_lookup(text)
+    info = orthography.stats()['reverse_lookup_cache']
+    assert (info['hits'], info['currsize']) == (0, 0)
+
+
+def test_persistent_reverse_lookup_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr('plover_melani.reverse_cache.CONFIG_DIR', str(tmp_path))
+    monkeypatch.setenv('PLOVER_MELANI_PERSISTENT_REVERSE_LOOKUP_CACHE', '1')
+    monkeypatch.setenv('PLOVER_MELANI_REVERSE_LOOKUP_COUNT', '3')
+    orthography = load_orthography()
+    outlines = [('PTto',), ('PTt', 'o'), ('PT', 'To')]
+    assert orthography.reverse_lookup('potto') == outlines
+    assert orthography.reverse_lookup('xyzq') == []
+    # A new session uses the results cached by the previous one.
+    orthography = load_orthography()
+    theory = orthography.get_theory()
+    def search_outlines(text, count):
+        raise AssertionError('not cached: %r' % text)
+    monkeypatch.setattr(theory, 'search_outlines', search_outlines)
+    assert orthography.reverse_lookup('potto') == outlines
+    assert orthography.reverse_lookup('xyzq') == []
+    # Results of incomplete searches are not persisted.
+    monkeypatch.setattr(theory, 'search_outlines',
+                        lambda text, count: ([[orthography.Stroke('SPsi')]], False))
+    assert orthography.reverse_lookup('spissimi') == [('SPsi',)]
+    assert orthography._persistent_cache.get('spissimi') is None
+    # Not with a different orthography.
+    orthography.load_theory({'PT': 'pot{^}', 'To': 'to'})
+    assert orthography.reverse_lookup('potto') == [('PT', 'To')]
+
+
+def test_lookup_cache(orthography):
+    for n in range(3):
+        orthography.lookup(('SPsi',))
+        with pytest.raises(KeyError):
+            orthography.lookup(('#',))
+    info = orthography.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (4, 2, 2)
+    orthography.load_theory({'S': 'ess'})
+    info = orthography.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (0, 0, 0)
+    assert orthography.lookup(('S',)) == 'ess'
+
+
+def test_hot_reload(orthography, tmp_path, monkeypatch):
+    monkeypatch.setattr('plover_melani.theory.CONFIG_DIR', str(tmp_path))
+    monkeypatch.setattr(orthography, 'RELOAD_CHECK_INTERVAL', 0.001)
+    fragments_json = tmp_path / 'melani_orthography.json'
+    fragments_json.write_text('{"S": "ess", "T": "ti"}')
+    assert orthography.lookup(('S',)) == 'ess'
+    theory = orthography.theory
+    fragments_json.write_text('{"S": "esse", "P": "pi"}')
+    os.utime(fragments_json, ns=(0, 0))
+    time.sleep(0.002)
+    orthography.lookup(('S',))
+    orthography._reload_thread.join()
+    assert orthography.theory is not theory
+    assert orthography.lookup(('S',)) == 'esse'
+    assert orthography.lookup(('P',)) == 'pi'
+    with pytest.raises(KeyError):
+        orthography.lookup(('T',))
+    # The previous snapshot is left untouched.
+    assert theory.translate_stroke(orthography.Stroke('T')) == 'ti'
+
+
+def test_hot_reload_during_lookups(orthography, tmp_path, monkeypatch):
+    monkeypatch.setattr('plover_melani.theory.CONFIG_DIR', str(tmp_path))
+    monkeypatch.setattr(orthography, 'RELOAD_CHECK_INTERVAL', 0.001)
+    errors = []
+    monkeypatch.setattr(orthography.log, 'error',
+                        lambda *args, **kwargs: errors.append(args))
+    fragments_json = tmp_path / 'melani_orthography.json'
+    fragments = json.loads(read_orthography().decode('utf-8'))
+    fragments_json.write_text(json.dumps(fragments))
+    orthography.get_theory()
+    stop = threading.Event()
+    def reverse_lookups():
+        # Random words, so the theory memoized stroke texts keep growing.
+        rnd = random.Random(0)
+        while not stop.is_set():
+            orthography.reverse_lookup(''.join(
+                rnd.choice('aeioubcdfglmnprstvz') for __ in range(12)))
+    thread = threading.Thread(target=reverse_lookups)
+    # Switch threads often, to make races more likely.
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    thread.start()
+    try:
+        for n in range(20):
+            fragments['S'] = 'esse%u' % n
+            # Note: replace the file atomically, so a reload never
+            # sees a partially written orthography.
+            tmp_json = tmp_path / 'melani_orthography.json.tmp'
+            tmp_json.write_text(json.dumps(fragments))
+            os.utime(tmp_json, ns=(n, n))
+            os.replace(tmp_json, fragments_json)
+            deadline = time.monotonic() + 10
+            while orthography.lookup(('S',)) != 'esse%u' % n:
+                assert time.monotonic() < deadline
+                time.sleep(0.001)
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
@@ -0,0 +1,62 @@
+import sqlite3
+
+from plover_melani.reverse_cache import (
+    ReverseLookupCache,
+    cache_key,
+    search_outlines,
+)
+from plover_melani.theory import Theory
+
+
+def test_cache_key():
+    theory = Theory()
+    assert cache_key(theory, 5) == (theory.orthography_digest, 5)
+    assert cache_key(Theory({'S': 'ess'}), 5) is None
+
+
+def test_search_outlines():
+    outlines, complete = search_outlines(Theory(), 'circoscrivano', 2)
+    assert outlines[0] == ('CIr', 'CO', 'SCVRAho')
+    assert len(outlines) == 2
+    assert complete
+    assert search_outlines(Theory(), 'xyzq', 2) == ((), True)
+
+
+def test_persistence(tmp_path):
+    filename = str(tmp_path / 'cache.db')
+    with ReverseLookupCache(('a', 5), filename) as cache:
+        assert cache.get('spissimi') is None
+        cache.put('spissimi', (('SPsi',), ('SP', 'Si')))
+        cache.put_many((('xyzq', ()), ('potto', (('PT', 'To'),))))
+        assert cache.get('spissimi') == (('SPsi',), ('SP', 'Si'))
+    with ReverseLookupCache(('a', 5), filename) as cache:
+        assert cache.get('spissimi') == (('SPsi',), ('SP', 'Si'))
+        assert cache.get('xyzq') == ()
+        assert cache.get('potto') == (('PT', 'To'),)
+    # Entries for other counts are kept, but not used.
+    with ReverseLookupCache(('a', 2), filename) as cache:
+        assert cache.get('spissimi') is None
+        cache.put('spissimi', (('SPsi',),))
+    with ReverseLookupCache(('a', 5), filename) as cache:
+        assert cache.get('spissimi') == (('SPsi',), ('SP', 'Si'))
+    # Changing the digest invalidates all the entries.
+    with ReverseLookupCache(('b', 5), filename) as cache:
+        assert cache.get('spissimi') is None
+    for count in (2, 5):
+        with ReverseLookupCache(('a', count), filename) as cache:
+            assert cache.get('spissimi') is None
+
+
+def test_old_schema(tmp_path):
+    filename = str(tmp_path / 'cache.db')
+    db = sqlite3.connect(filename)
+    with db:
+        db.execute('CREATE TABLE outlines (key TEXT NOT NULL, word TEXT NOT NULL, '
+                   'outlines TEXT NOT NULL, PRIMARY KEY (key, word)) WITHOUT ROWID')
+        db.execute("INSERT INTO outlines VALUES ('a:5', 'spissimi', 'SPsi')")
+    db.close()
+    with ReverseLookupCache(('a', 5), filename) as cache:
+        assert cache.get('spissimi') is None
+        cache.put('spissimi', (('SPsi',),))
+    with ReverseLookupCache(('a', 5), filename) as cache:
+        assert cache.get('spissimi') == (('SPsi',),)
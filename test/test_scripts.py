@@ -0,0 +1,253 @@
+import argparse
+import io
+import itertools
+import json
+
+import pytest
+
+from plover_melani.scripts import (
+    _common, briefs, compileortho, corpusstats, prefillcache, sortdict,
+    testortho, voc2json,
+)
+from plover_melani.reverse_cache import (
+    ReverseLookupCache,
+    cache_key,
+    search_outlines,
+)
+from plover_melani.theory import Stroke, Theory
+
+
+def test_common_chunked():
+    assert list(_common.chunked(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(_common.chunked([], 2)) == []
+
+
+@pytest.mark.parametrize('argv, expected', (
+    ([], 1),
+    (['-j', '3'], 3),
+    (['-j', '0'], None),
+    (['--jobs', 'x'], None),
+))
+def test_common_jobs_argument(capsys, argv, expected):
+    parser = argparse.ArgumentParser()
+    _common.add_jobs_argument(parser)
+    if expected is None:
+        with pytest.raises(SystemExit):
+            parser.parse_args(argv)
+        assert 'invalid number of jobs' in capsys.readouterr()[1]
+    else:
+        assert parser.parse_args(argv).jobs == expected
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_common_worker_pool(jobs):
+    with _common.worker_pool(jobs) as pool:
+        assert (pool is None) == (jobs == 1)
+        assert list(_common.imap(pool, abs, range(-10, 0), jobs)) == \
+                list(range(10, 0, -1))
+
+
+def test_testortho_bulk(capsys):
+    testortho._run_bulk(io.StringIO('circoscrivano\n\nxyzq\nspissimi\n'),
+                        testortho._text_to_steno, 1, 2)
+    out, err = capsys.readouterr()
+    assert out == 'circoscrivano\tCIr/CO/SCVRAho\nxyzq\t\nspissimi\tSPsi\n'
+    assert '3 words' in err and '1 unresolvable' in err
+    assert '2.00 strokes/word' in err
+    testortho._run_bulk(io.StringIO('CIr/CO/SCVRAho\nSPsi/#\n'),
+                        testortho._steno_to_text, 2, 1)
+    out, err = capsys.readouterr()
+    assert out == 'CIr/CO/SCVRAho\tcircoscrivano \nSPsi/#\t\n'
+    assert '2 words' in err and '1 unresolvable' in err
+
+
+@pytest.mark.parametrize('argv, expected', (
+    (['spissimi', 'circoscrivano'], 'SPsiCIr/CO/SCVRAho'),
+    (['/', 'SPsi'], 'spissimi '),
+    # Right bank only strokes are not options.
+    (['/', '-Es', 'SPE'], 'esspe'),
+    (['/', 'PT*'], 'PT*'),
+))
+def test_testortho_argv(capsys, argv, expected):
+    testortho.run(argv)
+    out, err = capsys.readouterr()
+    assert out == expected + '\n'
+
+
+VOC_CSV = '''\
+steno,text1,text2,readonly,extra
+SPsi,,spissimi&sp;,0,0
+PT,,pot,0,0
+PT\\To,potto&sp;,,1,0
+PT\\To,potto,,1,0
+CIr,circ,,0,0
+$S,1,,0,0
+STI,&var;|a|b c|d|,,0,0
+'''
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_voc2json_load_database(tmp_path, capsys, jobs):
+    database = tmp_path / 'voc-it.csv'
+    database.write_text(VOC_CSV, encoding='utf-8')
+    fragments, prefixes, suffixes = voc2json.load_database(
+        str(database), jobs=jobs, chunk_size=2)
+    assert {str(k): str(v) for k, v in fragments.items()} == {
+        'SPsi': 'spissimi',
+        'PT': 'pot{^}',
+    }
+    assert {str(k): str(v) for k, v in prefixes.items()} == {
+        'PT/To': 'potto',
+    }
+    assert {str(k): str(v) for k, v in suffixes.items()} == {
+        'CIr': 'circ{^}',
+        'STI': '{=(?i)([bc])/d/a}{^}',
+    }
+    out, err = capsys.readouterr()
+    assert err == ('warning: duplicate prefix dictionary entry for PT/To: '
+                   'potto{^}, already present potto, ignoring\n')
+
+
+def test_sortdict(tmp_path, monkeypatch):
+    dictionary = tmp_path / 'dict.json'
+    dictionary.write_bytes('{\n"-r": "erre",\n"T/S": "tesse",\n"R": "r",\n"SPsi": "spissimi"\n}'.encode('utf-8'))
+    unsorted = dictionary.read_bytes()
+    monkeypatch.setattr(sortdict, '_theory', None)
+    assert sortdict.process_dictionary(str(dictionary), check=True) == (str(dictionary), True, 0)
+    assert dictionary.read_bytes() == unsorted
+    assert sortdict.process_dictionary(str(dictionary)) == (str(dictionary), True, 0)
+    assert dictionary.read_text(encoding='utf-8') == \
+            '{\n"SPsi": "spissimi",\n"T/S": "tesse",\n"R": "r",\n"r": "erre"\n}'
+    mtime = dictionary.stat().st_mtime_ns
+    assert sortdict.process_dictionary(str(dictionary)) == (str(dictionary), False, 0)
+    assert dictionary.stat().st_mtime_ns == mtime
+    monkeypatch.setattr(sortdict, '_theory', Theory())
+    assert sortdict.process_dictionary(str(dictionary), check=True) == (str(dictionary), True, 1)
+    assert sortdict.process_dictionary(str(dictionary)) == (str(dictionary), True, 1)
+    assert dictionary.read_text(encoding='utf-8') == \
+            '{\n"T/S": "tesse",\n"R": "r",\n"r": "erre"\n}'
+
+
+def test_sortdict_duplicates(tmp_path, monkeypatch):
+    dictionary = tmp_path / 'dict.json'
+    dictionary.write_text('{"#S": "uno", "T": "t", "1": "one"}', encoding='utf-8')
+    monkeypatch.setattr(sortdict, '_theory', None)
+    with pytest.raises(ValueError, match=r'duplicate entries for 1 \(#S and 1\)'):
+        sortdict.process_dictionary(str(dictionary))
+    assert dictionary.read_text(encoding='utf-8') == '{"#S": "uno", "T": "t", "1": "one"}'
+
+
+def test_compileortho(tmp_path):
+    fragments = {
+        'S': 's{^}', 'SP': 'sp{^}', 'P': 'p{^}', 'T': 't{^}', 'SPT': 'spt',
+        'A': '{^}a{^}', 'Ai': '{^}ai', 'i': '{^}i', 'a': '{^}a',
+        '#S': '{^}uno',
+    }
+    theory = Theory(fragments)
+    entries = compileortho.compile_theory(theory)
+    # Check against all the strokes over the keys used by the combos.
+    keys = sorted({k for steno in fragments for k in Stroke(steno).keys()})
+    expected = {}
+    for n in range(1, len(keys) + 1):
+        for combination in itertools.combinations(keys, n):
+            stroke = Stroke(combination)
+            try:
+                expected[int(stroke)] = theory.translate_stroke(stroke)
+            except KeyError:
+                pass
+    assert dict(entries) == expected
+    assert [stroke for stroke, translation in entries] == sorted(expected)
+    dictionary = tmp_path / 'static.json'
+    with open(str(dictionary), 'wb') as fp:
+        compileortho.write_json(fp, entries)
+    assert dictionary.read_text(encoding='utf-8') == json.dumps(
+        {str(stroke): expected[int(stroke)] for stroke in sorted(map(Stroke, expected))},
+        indent=0, ensure_ascii=False, separators=(',', ': '))
+    table = tmp_path / 'static.bin'
+    with open(str(table), 'wb') as fp:
+        compileortho.write_binary(fp, entries)
+    table = compileortho.Table.load(str(table))
+    assert len(table) == len(expected)
+    for stroke, translation in expected.items():
+        assert table[stroke] == translation
+        assert table[Stroke.from_integer(stroke)] == translation
+    for stroke in (0, 1, max(expected) + 1, 1 << len(keys) * 2):
+        if stroke not in expected:
+            with pytest.raises(KeyError):
+                table[stroke]
+    with pytest.raises(KeyError):
+        table[Stroke('PT*')]
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_corpusstats(tmp_path, jobs):
+    dictionary = tmp_path / 'dict.json'
+    dictionary.write_text(json.dumps({
+        'PT/To': 'potto',
+        'PTo': 'potto',
+        'TH*': "dell'{^}{$}",
+        'S/S': 'due parole',
+    }), encoding='utf-8')
+    corpus = io.StringIO("Potto spissimi xyzq dell’orto potto\nxyzq potto xyzq\n")
+    counts, resolved = corpusstats.analyze([corpus], [str(dictionary)],
+                                           jobs=jobs, chunk_size=8)
+    assert counts == {'Potto': 1, 'potto': 2, 'spissimi': 1, 'xyzq': 3,
+                      "dell'": 1, 'orto': 1}
+    assert resolved['Potto'] == resolved['potto'] == ('dictionary', 1)
+    assert resolved["dell'"] == ('dictionary', 1)
+    assert resolved['spissimi'] == ('orthography', 1)
+    assert resolved['xyzq'] == (None, 0)
+    output = io.StringIO()
+    corpusstats.report(counts, resolved, fp=output)
+    lines = output.getvalue().splitlines()
+    assert lines[0] == '9 words (6 distinct)'
+    assert lines[1].startswith('coverage: 66.67% (dictionary: 44.44%')
+    assert lines[-2:] == ['most frequent unwritable words:', '         3 xyzq']
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_briefs(tmp_path, jobs):
+    dictionary = tmp_path / 'dict.json'
+    dictionary.write_text(json.dumps({
+        'CIOr': 'cioè',
+        'PTto': 'potto',
+    }), encoding='utf-8')
+    words = _common.read_frequencies(io.StringIO(
+        'circoscrivano 10\npotto 50\nspissimi 100\narrivederci 5\n'
+        'xyzq 1000\ncircoscrivano 1\n'
+    ))
+    assert words[:2] == [('circoscrivano', 10), ('potto', 50)]
+    assert _common.read_frequencies(io.StringIO('potto\n\n3 spissimi\n')) == \
+            [('potto', 1.0), ('spissimi', 3)]
+    suggestions = briefs.suggest_briefs(words, [str(dictionary)],
+                                        jobs=jobs, chunk_size=2)
+    # Note: `CIOr` is already used, and words only get one suggestion.
+    assert suggestions == [
+        ('CIOr*', 'circoscrivano', 'CIr/CO/SCVRAho', 20),
+        ('AEr*', 'arrivederci', 'Ar/RIct/Eth/Er/Ci', 20),
+    ]
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_prefillcache(tmp_path, jobs):
+    filename = str(tmp_path / 'cache.db')
+    words = ['potto', 'spissimi', 'xyzq', 'potto', 'circoscrivano']
+    assert prefillcache.prefill(words[:2], filename, count=3) == (0, 2, 0)
+    assert prefillcache.prefill(words, filename, count=3,
+                                jobs=jobs, chunk_size=1) == (2, 2, 0)
+    theory = Theory()
+    with ReverseLookupCache(cache_key(theory, 3), filename) as cache:
+        for word in words:
+            assert cache.get(word) == search_outlines(theory, word, 3)[0]
+
+
+def test_prefillcache_incomplete_search(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'cache.db')
+    theory = Theory()
+    monkeypatch.setattr(prefillcache, 'Theory', lambda: theory)
+    monkeypatch.setattr(theory, 'search_outlines',
+                        lambda text, count: ([[Stroke('SPsi')]], False))
+    # Results of incomplete searches are not cached.
+    assert prefillcache.prefill(['spissimi'], filename, count=3) == (0, 0, 1)
+    with ReverseLookupCache(cache_key(theory, 3), filename) as cache:
+        assert cache.get('spissimi') is None
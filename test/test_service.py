@@ -0,0 +1,99 @@
+import asyncio
+import errno
+import io
+import os
+import socket
+import threading
+
+import pytest
+
+from plover_melani.scripts import testortho
+from plover_melani.service import Client, Server
+from plover_melani.theory import Theory
+
+
+@pytest.fixture(scope='module')
+def server():
+    return Server(Theory(), [
+        {'PT/To': 'potto', 'SPsi': 'spissimi'},
+        {'SPsi': 'spissimi{^}'},
+    ])
+
+
+@pytest.mark.parametrize('request_, expected', (
+    ({'id': 1, 'op': 'translate', 'args': ['SPsi', 'xyzq', 'SPsi/SPsi']},
+     {'id': 1, 'results': ['spissimi', None, None]}),
+    ({'op': 'strokes_to_text', 'args': ['CIr/CO/SCVRAho', 'SPsi/#']},
+     {'results': ['circoscrivano ', None]}),
+    ({'op': 'strokes_from_text', 'args': ['circoscrivano', 'xyzq']},
+     {'results': ['CIr/CO/SCVRAho', None]}),
+    ({'op': 'lookup', 'args': ['PT\\To', 'SPsi', 'PT']},
+     {'results': ['potto', 'spissimi{^}', None]}),
+    ({'id': 'x', 'op': 'delete', 'args': []},
+     {'id': 'x', 'error': "invalid operation: 'delete'"}),
+    ({'op': 'lookup', 'args': 'PT'},
+     {'error': 'invalid arguments'}),
+    ([], {'error': 'invalid request'}),
+))
+def test_handle(server, request_, expected):
+    assert asyncio.run(server.handle(request_)) == expected
+
+
+def test_clients(server, tmp_path, capsys):
+    path = str(tmp_path / 'melani.sock')
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(server.start(path))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        clients = [Client(path) for __ in range(3)]
+        for client in clients:
+            assert client.strokes_from_text(['spissimi', 'circoscrivano']) == \
+                    ['SPsi', 'CIr/CO/SCVRAho']
+        for client in clients:
+            assert client.translate(['SPsi']) == ['spissimi']
+            assert client.lookup(['PT/To']) == ['potto']
+        with pytest.raises(ValueError):
+            clients[0].request('delete', [])
+        for client in clients:
+            client.close()
+        with Client(path) as client:
+            testortho._run_bulk(io.StringIO('circoscrivano\nxyzq\n'),
+                                testortho._text_to_steno, 1, 1, client)
+        out, err = capsys.readouterr()
+        assert out == 'circoscrivano\tCIr/CO/SCVRAho\nxyzq\t\n'
+        assert '3.00 strokes/word' in err
+        # Don't take over the socket of a running server.
+        with pytest.raises(OSError) as exc_info:
+            asyncio.run(server.start(path))
+        assert exc_info.value.errno == errno.EADDRINUSE
+        with Client(path) as client:
+            assert client.translate(['SPsi']) == ['spissimi']
+    finally:
+        listener.close()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(listener.wait_closed())
+        loop.close()
+
+
+def test_start_stale_socket(server, tmp_path):
+    path = str(tmp_path / 'melani.sock')
+    # Not a socket: left untouched.
+    with open(path, 'w') as fp:
+        fp.write('data')
+    with pytest.raises(OSError) as exc_info:
+        asyncio.run(server.start(path))
+    assert exc_info.value.errno == errno.EEXIST
+    with open(path) as fp:
+        assert fp.read() == 'data'
+    os.unlink(path)
+    # Stale socket (from a dead server): replaced.
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.close()
+    async def start():
+        listener = await server.start(path)
+        listener.close()
+        await listener.wait_closed()
+    asyncio.run(start())
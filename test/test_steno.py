@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from plover_melani import steno, system
+from plover_melani.theory import Stroke
+
+
+@pytest.mark.parametrize('text, expected', (
+    ('SPsi', 'SPsi'),
+    ('', ''),
+    ('#S', '1'),
+    ('1', '1'),
+))
+def test_parse_stroke(text, expected):
+    stroke = steno.parse_stroke(text)
+    assert stroke == Stroke(expected)
+    assert steno.stroke_steno(stroke) == expected
+    # Parsed strokes are interned.
+    assert steno.parse_stroke(expected) is stroke
+
+
+@pytest.mark.parametrize('text', (
+    'SS', 'x', 'S-P',
+    # Out of steno order.
+    'iSPs', 'iS', 'oS', 'eE', 'sS',
+    # Aliases are only supported by `parse_steno`.
+    '$S',
+))
+def test_parse_invalid_stroke(text):
+    with pytest.raises(ValueError):
+        steno.parse_stroke(text)
+
+
+def test_parse_steno():
+    assert steno.parse_steno('PT\\To/$S') == (Stroke('PT'), Stroke('To'), Stroke('1'))
+    assert steno.format_steno(steno.parse_steno('PT\\To/$S')) == 'PT/To/1'
+
+
+def test_stroke_steno_and_sort_key():
+    rng = random.Random(0)
+    strokes = [Stroke.from_integer(rng.getrandbits(len(system.KEYS)))
+               for __ in range(2000)]
+    for stroke in strokes:
+        assert steno.stroke_steno(stroke) == str(stroke)
+        assert steno.stroke_steno(int(stroke)) == str(stroke)
+    assert sorted(strokes, key=steno.sort_key) == sorted(strokes)
@@ -1,6 +1,291 @@
-from plover_melani.theory import Theory
+from array import array
+import random
+import sys
+import threading
+
+import pytest
+
+from plover_melani import system
+from plover_melani.theory import META_ATTACH, Stroke, Theory
+
+
+@pytest.fixture(scope='module')
+def theory():
+    return Theory()
+
+
+def greedy_translate_stroke(theory, stroke):
+    # Reference implementation: the original greedy decomposition.
+    if not theory._combos:
+        raise KeyError
+    keys = list(stroke.keys())
+    text = ''
+    while keys:
+        combo = Stroke(keys[0:theory._max_combos_len])
+        while combo:
+            if combo in theory._combos:
+                text += theory._combos[combo]
+                break
+            combo -= combo.last()
+        if not combo:
+            raise KeyError
+        keys = keys[len(combo):]
+    attach_start = text.startswith(META_ATTACH)
+    attach_end = text.endswith(META_ATTACH)
+    text = text.replace(META_ATTACH, '')
+    if attach_start:
+        text = META_ATTACH + text
+    if attach_end:
+        text = text + META_ATTACH
+    return text
+
+
+def sample_strokes(theory, count=20000, seed=42):
+    rng = random.Random(seed)
+    combos = [Stroke.from_integer(combo) for combo in theory._combos]
+    strokes = set(combos)
+    for combo1 in combos:
+        for combo2 in combos:
+            strokes.add(combo1 + combo2)
+    while len(strokes) < len(combos) ** 2 + count:
+        strokes.add(Stroke.from_integer(rng.getrandbits(len(system.KEYS))))
+    return sorted(strokes)
 
 
 def test_strokes_from_empty_text():
     theory = Theory()
     assert theory.strokes_from_text('') == []
+
+
+def test_translate_stroke_empty_theory():
+    with pytest.raises(KeyError):
+        Theory({}).translate_stroke(Stroke('S'))
+
+
+def test_translate_stroke_matches_greedy(theory):
+    for stroke in sample_strokes(theory):
+        try:
+            expected = greedy_translate_stroke(theory, stroke)
+        except KeyError:
+            expected = KeyError
+        try:
+            result = theory.translate_stroke(stroke)
+        except KeyError:
+            result = KeyError
+        assert result == expected, stroke
+
+
+def test_strokes_to_text():
+    theory = Theory({
+        'S': 's{^}',
+        'P': '{^}p',
+        'T': 'tu',
+        '-i': 'i',
+    })
+    assert theory.strokes_to_text([Stroke('S'), Stroke('T')]) == 'stu '
+    assert theory.strokes_to_text([Stroke('T'), Stroke('P')]) == 'tup '
+    assert theory.strokes_to_text([Stroke('T'), Stroke('i')]) == 'tu i '
+    assert theory.strokes_to_text([Stroke('T'), Stroke('S')]) == 'tu s'
+    assert theory.translate_stroke(Stroke('S')) == 's{^}'
+    assert theory.translate_stroke(Stroke('P')) == '{^}p'
+    assert theory.translate_stroke(Stroke('SPT')) == 'sptu'
+    assert theory.translate_stroke(Stroke('PT')) == '{^}ptu'
+
+
+@pytest.mark.parametrize('text, steno', (
+    ('sopraccitato', 'SOpr/Ac/CIt/Ato'),
+    ('precipitevolissimevolmente', 'PREc/Ip/It/Ect/Ohr/Is/SIshr/Ect/Ohrie'),
+    # Greedy decomposition would use 4 strokes: CIr/COs/CRIct/Aho.
+    ('circoscrivano', 'CIr/CO/SCVRAho'),
+))
+def test_strokes_from_text(theory, text, steno):
+    stroke_list = theory.strokes_from_text(text)
+    assert '/'.join(str(s) for s in stroke_list) == steno
+    assert theory.strokes_to_text(stroke_list) == text + ' '
+
+
+def test_strokes_from_text_no_decomposition(theory):
+    assert theory.strokes_from_text('sta' * 300 + 'q') == ()
+
+
+def test_compiled_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr('plover_melani.theory.CONFIG_DIR', str(tmp_path))
+    cache_filename = tmp_path / 'melani_orthography.cache'
+    theory = Theory()
+    assert cache_filename.exists()
+    # No leftover temporary file.
+    assert [p.name for p in tmp_path.iterdir()] == [cache_filename.name]
+    cached_theory = Theory()
+    assert cached_theory._combos == theory._combos
+    assert cached_theory._word_parts == theory._word_parts
+    assert cached_theory.translate_stroke(Stroke('SPsi')) == 'spissimi'
+    assert cached_theory.strokes_from_text('circoscrivano') == \
+            theory.strokes_from_text('circoscrivano')
+    # The cache is rebuilt when the orthography changes.
+    (tmp_path / 'melani_orthography.json').write_text('{"S": "ess"}')
+    custom_theory = Theory()
+    assert custom_theory.translate_stroke(Stroke('S')) == 'ess'
+    assert Theory()._combos == {Stroke('S'): 'ess'}
+
+
+def test_incremental_updates(theory):
+    fragments = {str(Stroke.from_integer(combo)): translation
+                 for combo, translation in theory._combos.items()}
+    items = sorted(fragments.items())
+    incremental_theory = Theory(dict(items[::2]))
+    for steno, translation in items[1::2]:
+        incremental_theory.add_fragment(steno, translation)
+    for text in ('sopraccitato', 'circoscrivano', 'spissimi'):
+        assert incremental_theory.strokes_from_text(text) == theory.strokes_from_text(text)
+    assert incremental_theory._combos == theory._combos
+    assert incremental_theory._word_parts == theory._word_parts
+    assert incremental_theory._word_parts_trie == theory._word_parts_trie
+    assert incremental_theory._combo_prefixes.keys() == theory._combo_prefixes.keys()
+    for steno, translation in items[::2]:
+        incremental_theory.remove_fragment(steno)
+    partial_theory = Theory(dict(items[1::2]))
+    for attr in (
+        '_combos', '_word_parts', '_word_parts_trie',
+        '_combos_lens', '_max_combos_len',
+        '_word_parts_lens', '_max_word_part_len',
+    ):
+        assert getattr(incremental_theory, attr) == getattr(partial_theory, attr)
+    for steno, translation in items[1::2]:
+        incremental_theory.remove_fragment(steno)
+    assert not incremental_theory._combos
+    assert not incremental_theory._combo_prefixes
+    assert not incremental_theory._word_parts
+    assert not incremental_theory._word_parts_trie
+    assert incremental_theory._max_combos_len == 0
+    assert incremental_theory._max_word_part_len == 0
+
+
+def test_copy_during_lookups():
+    theory = Theory()
+    stop = threading.Event()
+    def reverse_lookups():
+        rnd = random.Random(0)
+        while not stop.is_set():
+            theory.outlines_from_text(''.join(
+                rnd.choice('aeioubcdfglmnprstvz') for __ in range(12)))
+    thread = threading.Thread(target=reverse_lookups)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    thread.start()
+    try:
+        for __ in range(200):
+            copied_theory = theory.copy()
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(switch_interval)
+    assert copied_theory._combos == theory._combos
+    assert copied_theory._word_parts_trie == theory._word_parts_trie
+    assert copied_theory._stroke_texts == {}
+    assert copied_theory.prefilter_rejections == 0
+    # The copy is independent.
+    copied_theory.add_fragment('S', 'xyzq')
+    assert theory.translate_stroke(Stroke('S')) != 'xyzq'
+    assert 'xyzq' not in theory._word_parts
+
+
+def test_update():
+    theory = Theory({'S': 's{^}', 'T': 'tu', '-i': 'i'})
+    updated_theory = theory.copy()
+    assert updated_theory.update({'S': 's{^}', 'T': 'ta', 'P': 'pi'}) == 3
+    assert theory.translate_stroke(Stroke('ST')) == 'stu'
+    assert updated_theory.translate_stroke(Stroke('ST')) == 'sta'
+    assert updated_theory.translate_stroke(Stroke('P')) == 'pi'
+    with pytest.raises(KeyError):
+        updated_theory.translate_stroke(Stroke('-i'))
+
+
+def test_translate_many(theory):
+    strokes = sample_strokes(theory, count=1000)
+    translations, misses = theory.translate_many(array('I', strokes))
+    assert len(translations) == len(misses) == len(strokes)
+    for stroke, translation, miss in zip(strokes, translations, misses):
+        try:
+            expected = theory.translate_stroke(stroke)
+        except KeyError:
+            assert miss and translation is None
+        else:
+            assert not miss and translation == expected
+    assert 0 < sum(misses) < len(strokes)
+
+
+def test_prefilter():
+    theory = Theory({'S': 's{^}', 'ST': 'st{^}', 'Ti': 'ti'})
+    for steno in ('#S', 'SP', 'ST*', 'T', 'STi'):
+        with pytest.raises(KeyError):
+            theory.translate_stroke(Stroke(steno))
+    # Note: 'T' and 'STi' are not caught by the prefilter.
+    assert theory.prefilter_rejections == 3
+    theory.add_fragment('P', 'p{^}')
+    assert theory.translate_stroke(Stroke('SP')) == 'sp{^}'
+    theory.remove_fragment('Ti')
+    with pytest.raises(KeyError):
+        theory.translate_stroke(Stroke('Si'))
+    assert theory.prefilter_rejections == 4
+
+
+def test_outlines_from_text(theory):
+    outlines = theory.outlines_from_text('circoscrivano', count=10)
+    assert len(outlines) == 10
+    assert outlines[0] == theory.strokes_from_text('circoscrivano')
+    costs = [(len(o), sum(len(s) for s in o)) for o in outlines]
+    assert costs == sorted(costs)
+    for outline in outlines:
+        assert theory.strokes_to_text(outline) == 'circoscrivano '
+    assert theory.outlines_from_text('r') == [[Stroke('R')], [Stroke('-r')]]
+    assert theory.outlines_from_text('xyzq') == []
+    assert theory.outlines_from_text('') == []
+    assert theory.search_outlines('circoscrivano', count=3) == (outlines[:3], True)
+    assert theory.search_outlines('xyzq') == ([], True)
+    # Bounded search: fallback to `strokes_from_text` if nothing was found.
+    fallback = ([theory.strokes_from_text('circoscrivano')], False)
+    assert theory.search_outlines('circoscrivano', max_expansions=3) == fallback
+    assert theory.search_outlines('circoscrivano', timeout=0) == fallback
+    assert theory.search_outlines('xyzq', timeout=0) == ([], False)
+    text = ' '.join(['la casa bella sovrappopolazione'] * 20)
+    outlines, complete = theory.search_outlines(text)
+    assert outlines == [theory.strokes_from_text(text)] and outlines[0]
+    assert not complete
+
+
+@pytest.mark.parametrize('text', (
+    'circoscrivano',
+    'spissimi',
+    'potto',
+    'arrivederci',
+    'precipitevolissimevolmente',
+    'xyzq',
+))
+def test_reverse_lookup(theory, text):
+    expected = theory.strokes_from_text(text)
+    lookup = theory.reverse_lookup()
+    assert lookup.strokes() == []
+    for n, char in enumerate(text):
+        lookup.append(char)
+        assert lookup.text == text[:n + 1]
+        assert lookup.strokes() == theory.reverse_lookup(text[:n + 1]).strokes()
+    stroke_list = lookup.strokes()
+    assert len(stroke_list) == len(expected)
+    if stroke_list:
+        assert theory.strokes_to_text(stroke_list) == theory.strokes_to_text(expected)
+    else:
+        assert stroke_list == expected == ()
+
+
+def test_memory_report(theory):
+    report = theory.memory_report()
+    assert report['total'] == sum(v for k, v in report.items() if k != 'total')
+    assert all(report[name] > 0 for name in (
+        'combos', 'combo_prefixes', 'word_parts', 'word_parts_trie',
+    ))
+    # Combos lists are shared with the word parts trie.
+    for part, combo_list in theory._word_parts.items():
+        node = theory._word_parts_trie
+        for char in part:
+            node = node[char]
+        assert node[''] is combo_list